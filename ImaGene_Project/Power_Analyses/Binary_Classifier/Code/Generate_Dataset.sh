@@ -22,10 +22,11 @@
 
 # This script runs simulations using the MSMS simulator (https://www.mabs.at/publications/software-msms/) to generate (synthetic) genomic data, which are later used to train a machine-learning (ML) model. The model is trained to predict parameters like selection coefficient & time of a natural-selection event.
 
-# Usage: `./generate_dataset.sh <parameter_file> <output_directory>`
+# Usage: `./generate_dataset.sh <parameter_file> <output_directory> [batch]`
 # Args:
 # - <parameter_file>: Path to the file containing simulation parameters.
 # - <output_directory>: Directory where simulation results will be stored.
+# - [batch]: Optional batch number- simulate only this batch (used by 'Train_On_The_Fly.py' to simulate batches one at a time). By default, all NBATCH batches are simulated.
 
 # The script iterates over a range of selection coefficients & selection times, running simulations in batches & saving results in compressed format.
 
@@ -69,9 +70,15 @@ OUTPUT_DIR=$2
 # Accessing val: Use `$` sign- like saying, 'Give me content of container.'
 
 
-for (( INDEX=1; INDEX<=$NBATCH; INDEX++ ))
+FIRST_BATCH=${3:-1}
+LAST_BATCH=${3:-$NBATCH}
+# Batches to simulate: only batch given as 3rd arg, if any, otherwise 1 to NBATCH.
+# `${3:-1}` expands to val of 3rd arg, or to `1` if it's unset or empty.
+
+
+for (( INDEX=$FIRST_BATCH; INDEX<=$LAST_BATCH; INDEX++ ))
 do
-# Loop through batches as defined by NBATCH.
+# Loop through batches as defined by NBATCH (or through single batch given as 3rd arg).
 # `do` is necessary part of loop syntax. It marks beginning of block of cmds that will be executed as part of loop.
 # Similarly, `done` signifies end of loop block.
 
@@ -18,10 +18,17 @@ The following code includes both original ImaGene.py code & customisations by cp
 #-----
 # Standard-Library Imports
 # Standard library- collection of built-in modules & libraries that come bundled w/ Python language
+import collections # module for container datatypes, e.g. deques
+import concurrent.futures # module to run tasks in parallel threads
+import functools # module for higher-order functions, e.g. caching
 import gzip # module to work w/ gzip-compressed files
 import itertools # module to iterate & loop efficiently
+import json # module for working w/ JSON data
+import multiprocessing # module to run tasks in parallel processes
+from multiprocessing import resource_tracker, shared_memory # memory blocks shared between processes
 import os # module to interact w/ operating system
 import _pickle as pickle # module to (de)serialise Python objects
+import zlib # module for zlib (de)compression
 
 # 3rd-Party Imports
 import arviz # ArviZ library for Bayesian data analysis
@@ -38,6 +45,9 @@ from keras import models, layers, activations, optimizers, regularizers  # Keras
 from keras.models import load_model # function to load pre-trained Keras models
 from keras.utils.vis_utils import plot_model # utility to visualise Keras models
 
+# Local-Application Imports
+from ImaGene_msms import stream_msms_replicates, read_msms_shared # msms readers, kept in a module importing only numpy, so that worker processes of read_simulations start w/o TensorFlow
+
 
 ### ------------- utilities --------------------
 
@@ -58,6 +68,189 @@ def extract_msms_parameter(line, option, position=0):
     return line.partition(option)[2].split()[position]
 
 
+def pack_words(bits):
+    """
+    Pack each row of a boolean matrix into uint64 words, first column in the most significant bit
+
+    Comparing the words of two rows (first word first) gives the same order as comparing the rows element by element.
+
+    Keyword Arguments:
+        bits (array) -- boolean array of shape (nr_rows, nr_columns)
+
+    Return:
+        words (uint64 array of shape (nr_rows, ceil(nr_columns / 64)))
+    """
+    packed = np.packbits(bits, axis=1)
+    nr_bytes = -(-packed.shape[1] // 8) * 8
+    if nr_bytes != packed.shape[1]:
+        packed = np.concatenate([packed, np.zeros((packed.shape[0], nr_bytes - packed.shape[1]), dtype='uint8')], axis=1)
+    return np.ascontiguousarray(packed).view('>u8').astype('uint64')
+
+
+def count_bits(words):
+    """
+    Count set bits (popcount) of each element of an unsigned integer array
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    table = np.asarray([bin(i).count('1') for i in range(256)], dtype='uint8')
+    words = np.ascontiguousarray(words)
+    return table[words.view('uint8')].reshape(words.shape + (words.itemsize,)).sum(axis=-1, dtype='uint8')
+
+
+def group_uniques(words, groups):
+    """
+    Find unique rows of words within each group, in the same order np.unique(..., axis=0) returns them
+
+    Keyword Arguments:
+        words (array) -- uint64 keys of shape (nr_items, nr_words), e.g. from pack_words
+        groups (array) -- non-negative group id of each item
+
+    Return:
+        first (index of one item of each unique key), counts (nr of items with each unique key), group of each unique key
+    """
+    order = np.lexsort(tuple(words[:, j] for j in range(words.shape[1] - 1, -1, -1)) + (groups,))
+    sorted_words = words[order]
+    sorted_groups = groups[order]
+    new = np.ones(len(order), dtype='bool')
+    new[1:] = np.any(sorted_words[1:] != sorted_words[:-1], axis=1) | (sorted_groups[1:] != sorted_groups[:-1])
+    starts = np.flatnonzero(new)
+    counts = np.diff(np.append(starts, len(order)))
+    return order[starts], counts, sorted_groups[starts]
+
+
+def neutrality_statistics(counts, image_id, nr_images, nr_rows):
+    """
+    Site frequency spectrum and SFS-based neutrality statistics of all images at once, from the derived (255-valued) allele count at each site
+
+    Keyword Arguments:
+        counts (array) -- derived allele count at each site of all images
+        image_id (array) -- image each site belongs to
+        nr_images (int) -- nr of images
+        nr_rows (int) -- nr of haplotypes
+
+    Return:
+        dictionary of arrays w/ one value per image: 'SFS' (unfolded, nr_rows + 1 classes), 'S', 'theta_W', 'theta_pi', 'theta_H', 'tajima_D', 'fay_wu_H'
+    """
+    n = nr_rows
+    sfs = np.bincount(image_id * (n + 1) + counts, minlength=nr_images * (n + 1)).reshape(nr_images, n + 1)
+    i = np.arange(1, n)
+    a1, a2 = np.sum(1. / i), np.sum(1. / i**2)
+    S = sfs[:,1:n].sum(axis=1)
+    theta_W = S / a1
+    theta_pi = sfs[:,1:n] @ (2. * i * (n - i) / (n * (n - 1)))
+    theta_H = sfs[:,1:n] @ (2. * i * i / (n * (n - 1)))
+    # Tajima (1989)
+    b1, b2 = (n + 1) / (3. * (n - 1)), 2. * (n**2 + n + 3) / (9. * n * (n - 1))
+    c1, c2 = b1 - 1. / a1, b2 - (n + 2) / (a1 * n) + a2 / a1**2
+    e1, e2 = c1 / a1, c2 / (a1**2 + a2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tajima_D = np.where(S > 0, (theta_pi - theta_W) / np.sqrt(e1 * S + e2 * S * (S - 1)), np.nan)
+    return {'SFS': sfs, 'S': S, 'theta_W': theta_W, 'theta_pi': theta_pi, 'theta_H': theta_H, 'tajima_D': tajima_D, 'fay_wu_H': theta_pi - theta_H}
+
+
+def haplotype_homozygosity(data, positions, centres, window=51):
+    """
+    Garud's haplotype homozygosity statistics (H1, H12, H2/H1) of all images at once, in a window of sites around a position of each image
+
+    Haplotypes of all windows are bit-packed into uint64 words and identical ones counted in one sort.
+
+    Keyword Arguments:
+        data (RaggedArray) -- images of 0s and 255s
+        positions (RaggedArray) -- sorted positions of the sites of each image
+        centres (array) -- position around which to centre the window of each image (e.g. the selected site)
+        window (int) -- nr of sites in the window (all sites for shorter images)
+
+    Return:
+        dictionary of arrays w/ one value per image: 'H1', 'H12', 'H2_H1'
+    """
+    nr_images, nr_rows = len(data), data.buffer.shape[0]
+    lengths = data.lengths
+    offsets = data.offsets[:-1]
+    # nearest site to each centre: positions of image i are shifted by i * span, so one searchsorted covers all images
+    span = (positions.buffer.max() - positions.buffer.min() + 1.) if len(positions.buffer) > 0 else 1.
+    shifted = positions.buffer + positions.segment_ids() * span
+    target = np.asarray(centres, dtype='float64') + np.arange(nr_images) * span
+    last = np.maximum(offsets + lengths - 1, offsets).clip(0, max(len(shifted) - 1, 0))
+    after = np.clip(np.searchsorted(shifted, target), offsets, last)
+    before = np.clip(after - 1, offsets, last)
+    if len(shifted) > 0:
+        nearest = np.where(np.abs(shifted[after] - target) < np.abs(shifted[before] - target), after, before) - offsets
+    else:
+        nearest = np.zeros(nr_images, dtype='int64')
+    start = np.clip(nearest - window // 2, 0, np.maximum(lengths - window, 0))
+    columns = start[:,np.newaxis] + np.arange(window)
+    valid = columns < lengths[:,np.newaxis]
+    columns = np.where(valid, columns + offsets[:,np.newaxis], 0)
+    # (nr_images * nr_rows, window) haplotypes, sites beyond short images set to 0
+    bits = (np.take(data.buffer[:,:,0], columns, axis=1) == 255) & valid[np.newaxis]
+    bits = bits.transpose(1, 0, 2).reshape(nr_images * nr_rows, window)
+    first, counts, groups = group_uniques(pack_words(bits), np.repeat(np.arange(nr_images), nr_rows))
+    frequencies = counts / nr_rows
+    # most frequent haplotypes first within each image
+    order = np.lexsort((-counts, groups))
+    frequencies, groups = frequencies[order], groups[order]
+    top = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    p1 = np.zeros(nr_images)
+    p2 = np.zeros(nr_images)
+    p1[groups[top]] = frequencies[top]
+    second = top + 1
+    has_second = second < len(groups)
+    has_second[has_second] = groups[second[has_second]] == groups[top[has_second]]
+    p2[groups[top[has_second]]] = frequencies[second[has_second]]
+    H1 = np.bincount(groups, weights=frequencies**2, minlength=nr_images)
+    return {'H1': H1, 'H12': H1 + 2 * p1 * p2, 'H2_H1': (H1 - p1**2) / H1}
+
+
+@functools.lru_cache(maxsize=None)
+def resize_weights(input_length, output_length):
+    """
+    Linear weights of skimage.transform.resize (anti_aliasing=True, mode='reflect') along one axis, cached for each pair of lengths
+
+    Smoothing and interpolation are separable, so resizing an image is weights_rows @ image @ weights_columns.T. The weights are obtained by resizing an identity matrix, so they follow the installed scikit-image exactly.
+
+    Keyword Arguments:
+        input_length (int) -- nr of rows (or columns) of the input images
+        output_length (int) -- nr of rows (or columns) of the resized images
+
+    Return:
+        weights (float32 array of shape (output_length, input_length))
+    """
+    weights = skimage.transform.resize(np.eye(input_length), (output_length, input_length), anti_aliasing=True, mode='reflect')
+    return weights.astype('float32')
+
+
+def preprocess_windows(images, positions, dimensions=(198, 192), minimal_maf=0.01, ordering='rows_freq'):
+    """
+    Preprocess genomic windows as the synthetic training data: filter_freq, sort, resize and convert w/ flip
+
+    Keyword Arguments:
+        images (list) -- uint8 haplotype windows (nr haplotypes, nr sites, 1), all w/ the same nr of rows
+        positions (list) -- positions of the sites of each window
+        dimensions (tuple) -- nr of rows and columns after resizing
+        minimal_maf (float) -- minimal minor allele frequency to retain a site
+        ordering (string) -- ordering passed to ImaGene.sort
+
+    Return:
+        keep (boolean array) -- windows with at least one retained site
+        data (float32 array (nr kept windows, rows, columns, 1))
+    """
+    gene = ImaGene(data=images, positions=positions, description=[{}] * len(images))
+    gene.targets = np.zeros(len(images), dtype='int32')
+    gene.dimensions = (np.full(len(images), images[0].shape[0]), np.array([image.shape[1] for image in images]))
+    gene.filter_freq(minimal_maf)
+    # windows w/o any retained site cannot be resized
+    keep = gene.data.lengths > 0
+    if not np.all(keep):
+        gene.subset(np.flatnonzero(keep))
+    if len(gene.data) == 0:
+        return keep, np.zeros((0,) + tuple(dimensions) + (1,), dtype='float32')
+    gene.sort(ordering)
+    gene.resize(dimensions)
+    gene.convert(flip=True)
+    return keep, gene.data
+
+
 def get_index_classes(targets, classes):
     """
     Get index array for targets corresponding to selected classes
@@ -69,10 +262,7 @@ def get_index_classes(targets, classes):
     Return:
         index (array)
     """
-    index = []
-    for counter,value in enumerate(classes):
-        index = np.concatenate([index, np.where(targets==value)[0]])
-    return np.asarray(index, dtype='int')
+    return np.concatenate([np.flatnonzero(targets == value) for value in classes] + [np.zeros(0, dtype='int')])
 
 
 def get_index_random(genes=[], length=0):
@@ -97,9 +287,22 @@ def get_index_random(genes=[], length=0):
 
 def calculate_allele_frequency(genes, position):
     """
-    ...
+    Count the 255-valued allele at a position (or at each of a list of positions) in all images, through a site index
+
+    Keyword Arguments:
+        genes (object) -- ImaGene object (before resizing, so that columns match positions)
+        position (float or array) -- position(s) to query
+
+    Return:
+        counts (list w/ one count per image for a single position; array (nr images, nr positions) for a list), -1 where an image has no site at the position
+
+    Raises:
+        ValueError if positions do not match the columns of the images (see ImaGene.index_sites)
     """
-    return [np.where(genes.data[i][:,np.where(genes.positions[i]==position)[0][0],0]==255,1,0).sum() for i in range(len(genes.data))]
+    index = genes.index_sites()
+    if np.ndim(position) == 0:
+        return index.counts_at([position])[:,0].tolist()
+    return index.counts_at(position)
 # Fn calculates frequency of specific allele at given position across all genetic data in instance of `ImaGene` class.
 # `position` param related to `positions` attribute in `ImaGene` class.
 
@@ -126,34 +329,181 @@ def to_binary(targets):
 
 
 def to_categorical(targets, wiggle=0, sd=0):
+    """
+    One-hot (or smoothed) class matrix of targets, built in one broadcast
+
+    Keyword Arguments:
+        targets (array) -- target of each image
+        wiggle (int) -- if > 0, move each label by a random nr of classes in [-wiggle, wiggle] (within bounds)
+        sd (float) -- if > 0, replace each one-hot row by a normal density (sd in nr of classes) centred on the label
+
+    Return:
+        results (float32 array (nr targets, nr classes))
+    """
     classes = np.unique(targets)
     nr_classes = len(classes)
-    results = np.zeros((len(targets), len(classes)), dtype='float32')
-    for counter, value in enumerate(targets):
-        index = np.where(classes == value)[0]
-        # add wiggle (if any)
-        if wiggle > 0:
-            index += np.random.randint(low=-wiggle, high=wiggle+1)
-            if index < 0:
-                index = 0
-            elif index >= results.shape[1]:
-                index = results.shape[1] - 1
-        results[counter, index] = 1.
-        # add sd (if any)
-        if sd > 0:
-            probs = scipy.stats.norm.pdf(range(nr_classes), loc=index, scale=sd)
-            results[counter, ] = probs / probs.sum()
-            del probs
+    index = np.searchsorted(classes, targets)
+    # add wiggle (if any)
+    if wiggle > 0:
+        index = np.clip(index + np.random.randint(low=-wiggle, high=wiggle+1, size=len(index)), 0, nr_classes - 1)
+    # add sd (if any)
+    if sd > 0:
+        probs = scipy.stats.norm.pdf(np.arange(nr_classes)[np.newaxis,:], loc=index[:,np.newaxis], scale=sd)
+        return (probs / probs.sum(axis=1, keepdims=True)).astype('float32')
+    results = np.zeros((len(targets), nr_classes), dtype='float32')
+    results[np.arange(len(targets)), index] = 1.
     return results
 
-def load_imagene(file):
+def save_arrays(folder, arrays):
     """
-    Load ImaGene object
+    Save numpy or ragged arrays as .npy files in a folder
+
+    Keyword Arguments:
+        folder (string) -- existing folder
+        arrays (dict) -- name: array
+
+    Return:
+        layout (dict) -- name: axis of ragged arrays (None for numpy arrays), needed by load_arrays
     """
-    with open(file, 'rb') as fp:
-        gene = pickle.load(fp)
+    layout = {}
+    for name, array in arrays.items():
+        if isinstance(array, RaggedArray):
+            np.save(os.path.join(folder, name + '.npy'), array.buffer)
+            np.save(os.path.join(folder, name + '_offsets.npy'), array.offsets)
+            layout[name] = array.axis
+        else:
+            np.save(os.path.join(folder, name + '.npy'), np.asarray(array))
+            layout[name] = None
+    return layout
+
+def load_arrays(folder, layout, mmap_mode=None):
+    """
+    Load arrays saved by save_arrays, as memory maps if mmap_mode is set (e.g. 'r')
+    """
+    arrays = {}
+    for name, axis in layout.items():
+        array = np.load(os.path.join(folder, name + '.npy'), mmap_mode=mmap_mode)
+        if axis != None:
+            array = RaggedArray(array, np.load(os.path.join(folder, name + '_offsets.npy')), axis)
+        arrays[name] = array
+    return arrays
+
+def build_imagene(data, arrays, meta):
+    """
+    Build ImaGene object from saved images, arrays and metadata (bypassing __init__, so memory maps are kept as they are)
+    """
+    arrays = dict(arrays)
+    gene = ImaGene.__new__(ImaGene)
+    gene.data = data
+    gene.positions = arrays.pop('positions')
+    gene.dimensions = tuple(arrays.pop('dimensions'))
+    gene.description = ImaDescription(meta['description'], arrays.pop('description_file_id'))
+    for name, array in arrays.items():
+        if name.startswith('statistics_'):
+            if not hasattr(gene, 'statistics'):
+                gene.statistics = {}
+            gene.statistics[name[len('statistics_'):]] = array
+        else:
+            setattr(gene, name, array)
+    for name, value in meta['attributes'].items():
+        setattr(gene, name, value)
     return gene
 
+def load_imagene(file, mmap_mode='c'):
+    """
+    Load ImaGene object, either pickled or saved as a folder by ImaGene.save(format='npy') or ImaGene.save(format='store')
+
+    For 'npy' folders, images and positions are memory maps, copy-on-write by default: pages are read from disk when first used, and methods that modify images in place (e.g. sort, majorminor, filter_freq w/ majorminor) work on private copies of the pages they change, never on the files. With mmap_mode='r' the object is read-only, and these methods raise ValueError.
+
+    Keyword Arguments:
+        file (string) -- pickle file or folder
+        mmap_mode (string) -- for 'npy' folders, images and positions are opened as memory maps in this mode ('c' copy-on-write, 'r' read-only; None reads them in memory)
+    """
+    if not os.path.isdir(file):
+        with open(file, 'rb') as fp:
+            gene = pickle.load(fp)
+        return gene
+
+    with open(os.path.join(file, 'meta.json'), 'r') as fp:
+        meta = json.load(fp)
+    if meta.get('format') == 'store':
+        return ImaGeneStore(file).to_imagene()
+    arrays = load_arrays(file, {name: meta['layout'][name] for name in ['data', 'positions']}, mmap_mode)
+    arrays.update(load_arrays(file, {name: axis for name, axis in meta['layout'].items() if name not in arrays}))
+    return build_imagene(arrays.pop('data'), arrays, meta)
+
+def make_datasets(stores, batch_size=64, validation_fraction=0.10, shuffle_buffer=4096, seed=None, threads=None):
+    """
+    tf.data input pipelines over ImaGene stores, for a single model.fit
+
+    Each store is split into training and validation images w/ the same class proportions (see ImaSampler). Chunks are read interleaved across stores, decompressed in parallel (see ImaGeneStore.decompress_chunk), shuffled within a bounded buffer (training only), batched and prefetched, so that reading overlaps w/ training steps.
+
+    Only the images of the split are unpacked from each chunk. The validation images are fixed, so they are cached bit-packed (1 bit per pixel) after the first pass and only unpacked in later epochs.
+
+    Keyword Arguments:
+        stores (list) -- ImaGeneStore objects
+        batch_size (int) -- nr of images per training step
+        validation_fraction (float) -- fraction of the images of each store held out for validation
+        shuffle_buffer (int) -- nr of images in the shuffle buffer
+        seed (int) -- seed of splits and shuffling
+        threads (int) -- nr of threads the pipelines may use (private thread pool and parallelism within ops), e.g. a process' share of the cores when several models train at once (all cores by default)
+
+    Return:
+        training dataset (repeated indefinitely), validation dataset, nr of training steps per store (e.g. steps_per_epoch, so that an epoch is one pass over one store on average)
+    """
+    chunk_size = stores[0].chunk_size
+    # training images of each store
+    masks = []
+    for k, store in enumerate(stores):
+        train_index, validation_index = ImaSampler(store.arrays['targets'], seed=None if seed == None else seed + k).split((1 - validation_fraction, validation_fraction))
+        mask = np.zeros(len(store), dtype='bool')
+        mask[train_index] = True
+        masks.append(mask)
+    nr_chunks = tf.constant([len(store.index) - 1 for store in stores], dtype='int64')
+    image_spec = ((None,) + stores[0].shape, tf.as_dtype(stores[0].values.dtype))
+    packed_spec = (None, (int(np.prod(stores[0].shape)) + 7) // 8)
+    target_spec = ((None,) + stores[0].arrays['targets'].shape[1:], tf.as_dtype(stores[0].arrays['targets'].dtype))
+
+    def read(k, c, training):
+        # bit-packed images of the split only, unpacked later
+        store = stores[k]
+        selected = slice(c * chunk_size, min((c + 1) * chunk_size, len(store)))
+        keep = masks[k][selected] if training else ~masks[k][selected]
+        return store.read_packed(c, keep), np.asarray(store.arrays['targets'][selected])[keep]
+
+    def store_chunks(k):
+        return tf.data.Dataset.range(nr_chunks[k]).map(lambda c: (k, c))
+
+    def pipeline(training):
+        def load(k, c):
+            packed, targets = tf.numpy_function(lambda k, c: read(k, c, training), [k, c], (tf.uint8, target_spec[1]))
+            return k, tf.ensure_shape(packed, packed_spec), tf.ensure_shape(targets, target_spec[0])
+
+        def decode(k, packed, targets):
+            images = tf.numpy_function(lambda k, packed: stores[k].unpack(packed), [k, packed], image_spec[1])
+            return tf.ensure_shape(images, image_spec[0]), targets
+
+        # (store, chunk) pairs, taking one chunk of each store in turn
+        chunks = tf.data.Dataset.range(len(stores)).interleave(store_chunks, cycle_length=len(stores))
+        if training:
+            chunks = chunks.repeat()
+        chunks = chunks.map(load, num_parallel_calls=tf.data.AUTOTUNE)
+        if not training:
+            chunks = chunks.cache()
+        images = chunks.map(decode, num_parallel_calls=tf.data.AUTOTUNE).unbatch()
+        if training:
+            images = images.shuffle(shuffle_buffer, seed=seed)
+        images = images.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+        if threads is not None:
+            options = tf.data.Options()
+            options.threading.private_threadpool_size = threads
+            options.threading.max_intra_op_parallelism = threads
+            images = images.with_options(options)
+        return images
+
+    steps = int(np.ceil(np.mean([mask.sum() for mask in masks]) / batch_size))
+    return pipeline(True), pipeline(False), steps
+
 def load_imanet(file):
     """
     Load ImaNet object
@@ -162,30 +512,70 @@ def load_imanet(file):
         net = pickle.load(fp)
     return net
 
+def posterior_summary(probs, classes, H0_class=0, credible_interval=0.95, chunk_size=4096):
+    """
+    Summarise the discrete posterior distribution over classes of many images at once, exactly (no sampling)
+
+    The HPD interval is the narrowest interval of classes [a, b] whose probability is at least credible_interval (the leftmost one if several are as narrow), found over all pairs of classes from cumulative sums.
+
+    Keyword Arguments:
+        probs (array) -- predicted probabilities (nr images, nr classes)
+        classes (array) -- value of each class
+        H0_class (int) -- index of the class of the null hypothesis, for Bayes factors
+        credible_interval (float) -- probability of HPD intervals
+        chunk_size (int) -- nr of images whose class pairs are compared at once
+
+    Return:
+        dictionary w/ 'MAP', 'mean', 'BF' (one value per image) and 'HPD' (nr images, 2)
+    """
+    probs = np.atleast_2d(np.asarray(probs, dtype='float64'))
+    classes = np.asarray(classes)
+    summary = {'MAP': classes[np.argmax(probs, axis=1)]}
+    summary['mean'] = probs @ classes / probs.sum(axis=1)
+    summary['BF'] = (1 - probs[:,H0_class]) / probs[:,H0_class]
+
+    order = np.argsort(classes, kind='stable')
+    values = classes[order].astype('float64')
+    nr_classes = len(values)
+    # width of interval [values[a], values[b]] for b >= a
+    widths = values[np.newaxis,:] - values[:,np.newaxis]
+    widths[np.tril_indices(nr_classes, -1)] = np.inf
+    summary['HPD'] = np.zeros((len(probs), 2), dtype=values.dtype)
+    for i in range(0, len(probs), chunk_size):
+        cumulative = np.zeros((len(probs[i:i+chunk_size]), nr_classes + 1))
+        np.cumsum(probs[i:i+chunk_size][:,order] / probs[i:i+chunk_size].sum(axis=1, keepdims=True), axis=1, out=cumulative[:,1:])
+        # probability of each interval, w/ a little tolerance for rounding
+        mass = cumulative[:,np.newaxis,1:] - cumulative[:,:-1,np.newaxis]
+        candidates = np.where(mass >= credible_interval - 1e-9, widths[np.newaxis], np.inf)
+        best = np.argmin(candidates.reshape(len(candidates), -1), axis=1)
+        summary['HPD'][i:i+chunk_size,0] = values[best // nr_classes]
+        summary['HPD'][i:i+chunk_size,1] = values[best % nr_classes]
+    return summary
+
+
 def plot_scores(model, gene, classes, H0_class=0):
     """
     Plot scores of a predicted image as posterior distribution
     """
-    probs = model.predict(gene.data, batch_size=None)[0]
-    # Monte Carlo sampling
-    samples_distr = np.random.choice(classes, size = 100000, replace = True, p = probs)
-    # summary statistics and metrics of confidence
-    # HPD = pymc3.stats.hpd(samples_distr, credible_interval = 0.95)
-    HPD = az.hdi(samples_distr, credible_interval = 0.95)
-    BF = (1 - probs[H0_class]) / probs[H0_class]
-    MAP = classes[np.argmax(probs)]
-    MLE = np.average(classes, weights = probs)
+    probs = model.predict(np.asarray(gene.data), batch_size=None)[0]
+    # summary statistics and metrics of confidence, exact on the discrete distribution
+    summary = posterior_summary(probs[np.newaxis], classes, H0_class=H0_class)
+    HPD = summary['HPD'][0]
+    BF = summary['BF'][0]
+    MAP = summary['MAP'][0]
+    MLE = summary['mean'][0]
     
     # plot
     tick_marks = classes
     cen_tick = classes
-    plt.hist(samples_distr, color='#a6bddb', bins=len(classes), density=True)
+    width = np.diff(np.sort(classes)).min() if len(classes) > 1 else 1.
+    plt.bar(classes, probs / probs.sum() / width, width=width, color='#a6bddb')
     plt.xlim([classes.min(), classes.max()])
     plt.xticks(cen_tick, cen_tick, rotation=45, fontsize=10)
     plt.yticks(fontsize=10)
     plt.ylabel('Density', fontsize=12)
     plt.xlabel('Parameter', fontsize=12)
-    plt.title('Sampled posterior distribution')
+    plt.title('Posterior distribution')
     plt.grid(True)
     plt.axvline(MLE, label='mean ('+str(round(MLE,2))+')', color='r', linestyle='--')
     plt.axvline(MAP, label='MAP ('+str(MAP)+')', color='b', linestyle='--')
@@ -201,6 +591,316 @@ def plot_scores(model, gene, classes, H0_class=0):
 
 ### -------- objects ------------------
 
+class RaggedArray:
+    """
+    Arrays of different lengths along one axis, stored back to back in one contiguous buffer plus an offsets array
+    """
+    def __init__(self, buffer, offsets, axis=0):
+        self.buffer = buffer
+        self.offsets = np.asarray(offsets, dtype='int64')
+        self.axis = axis
+        return None
+
+    @classmethod
+    def from_list(cls, arrays, axis=0):
+        """
+        Concatenate a list of arrays (same shape except along axis) into one buffer
+        """
+        offsets = np.zeros(len(arrays) + 1, dtype='int64')
+        np.cumsum([array.shape[axis] for array in arrays], out=offsets[1:])
+        if len(arrays) == 0:
+            return cls(np.zeros(0), offsets, axis)
+        return cls(np.concatenate(arrays, axis=axis), offsets, axis)
+
+    @property
+    def lengths(self):
+        """
+        Length of each array along axis
+        """
+        return np.diff(self.offsets)
+
+    def segment_ids(self):
+        """
+        Index of the array each element of the buffer (along axis) belongs to
+        """
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def take(self, index):
+        """
+        Gather arrays by index into a new ragged array (one fancy-index call on the buffer)
+        """
+        index = np.arange(len(self))[index]
+        lengths = self.lengths[index]
+        offsets = np.zeros(len(index) + 1, dtype='int64')
+        np.cumsum(lengths, out=offsets[1:])
+        sources = np.repeat(self.offsets[:-1][index] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return RaggedArray(np.take(self.buffer, sources, axis=self.axis), offsets, self.axis)
+
+    def compress(self, mask):
+        """
+        Keep only the elements (along axis) where mask, a boolean array over the whole buffer, is True
+        """
+        kept = np.zeros(len(mask) + 1, dtype='int64')
+        np.cumsum(mask, out=kept[1:])
+        return RaggedArray(np.compress(mask, self.buffer, axis=self.axis), kept[self.offsets], self.axis)
+
+    def _slice(self, i):
+        return (slice(None),) * self.axis + (slice(self.offsets[i], self.offsets[i + 1]),)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        # a single array is a view on the buffer, anything else a gathered copy
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            return self.buffer[self._slice(index)]
+        return self.take(index)
+
+    def __setitem__(self, index, value):
+        self.buffer[self._slice(index)] = value
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.buffer[self._slice(i)]
+
+
+class IndexView:
+    """
+    Lazy view of selected items (e.g. a shuffle) of an array, ragged array or list: the index is recorded, composed w/ further selections and gathered in one go only when materialised
+    """
+    def __init__(self, base, index):
+        if isinstance(base, IndexView):
+            index = base.index[index]
+            base = base.base
+        self.base = base
+        self.index = np.arange(len(base))[index]
+        return None
+
+    def materialise(self):
+        """
+        Gather the selected items in one call
+        """
+        if type(self.base) == list:
+            return [self.base[i] for i in self.index]
+        return self.base[self.index]
+
+    @property
+    def shape(self):
+        if hasattr(self.base, 'shape'):
+            return (len(self.index),) + self.base.shape[1:]
+        return (len(self.index),)
+
+    @property
+    def dtype(self):
+        return self.base.dtype
+
+    def __array__(self, dtype=None, copy=None):
+        array = np.asarray(self.materialise())
+        return array if dtype == None else array.astype(dtype)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        # a single item is read from the base, anything else is a new (composed) view
+        if isinstance(index, (int, np.integer)):
+            return self.base[self.index[index]]
+        return IndexView(self, index)
+
+    def __iter__(self):
+        for i in self.index:
+            yield self.base[i]
+
+
+class SiteIndex:
+    """
+    Allele counts of all sites of a batch of images, sorted by (image, position) keys so that any list of positions is queried w/ one searchsorted and gather
+    """
+    def __init__(self, positions, counts, nr_rows):
+        """
+        Keyword Arguments:
+            positions (RaggedArray) -- positions of the sites of each image
+            counts (array) -- allele count at each site (over the buffer of positions)
+            nr_rows (int) -- nr of haplotypes, to turn counts into frequencies
+        """
+        self.nr_images = len(positions)
+        self.nr_rows = nr_rows
+        # positions are rank-encoded, so (image, rank) fits in one int64 key
+        self.unique_positions = np.unique(positions.buffer)
+        rank = np.searchsorted(self.unique_positions, positions.buffer)
+        keys = positions.segment_ids() * len(self.unique_positions) + rank
+        # stable, so that the first of repeated positions is found
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.counts = np.asarray(counts)[order].astype('int64')
+        return None
+
+    def counts_at(self, positions, images=None):
+        """
+        Allele counts at positions
+
+        Keyword Arguments:
+            positions (array) -- positions to query
+            images (array) -- images to query (all by default)
+
+        Returns:
+            counts (int64 array (nr images, nr positions)), -1 where an image has no site at the position
+        """
+        positions = np.asarray(positions)
+        images = np.arange(self.nr_images) if images is None else np.asarray(images)
+        if len(self.keys) == 0:
+            return np.full((len(images), len(positions)), -1, dtype='int64')
+        rank = np.searchsorted(self.unique_positions, positions)
+        found = self.unique_positions[np.minimum(rank, len(self.unique_positions) - 1)] == positions
+        keys = images[:,np.newaxis] * len(self.unique_positions) + rank[np.newaxis,:]
+        where = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        hit = (self.keys[where] == keys) & found[np.newaxis,:]
+        return np.where(hit, self.counts[where], -1)
+
+    def frequencies_at(self, positions, images=None):
+        """
+        Allele frequencies at positions (nr images, nr positions), NaN where an image has no site at the position
+        """
+        counts = self.counts_at(positions, images)
+        return np.where(counts >= 0, counts / self.nr_rows, np.nan)
+
+
+class ImaDescription:
+    """
+    Columnar description of simulations: one record per msms file and, for each replicate, the id of its file
+    """
+    def __init__(self, records=None, file_id=None):
+        self.records = [] if records is None else records
+        self.file_id = np.zeros(0, dtype='int32') if file_id is None else np.asarray(file_id, dtype='int32')
+        return None
+
+    @classmethod
+    def from_list(cls, description):
+        """
+        Build from a list with one description dictionary per replicate (replicates sharing the same dictionary share one record)
+        """
+        records = []
+        file_id = np.zeros(len(description), dtype='int32')
+        seen = {}
+        for i, desc in enumerate(description):
+            if id(desc) not in seen:
+                seen[id(desc)] = len(records)
+                records.append(desc)
+            file_id[i] = seen[id(desc)]
+        return cls(records, file_id)
+
+    def append(self, record, nr_replicates):
+        """
+        Add the description of one file shared by its nr_replicates replicates
+        """
+        self.file_id = np.concatenate([self.file_id, np.full(nr_replicates, len(self.records), dtype='int32')])
+        self.records.append(record)
+        return 0
+
+    def column(self, name):
+        """
+        Values of one parameter for all replicates, as an array
+        """
+        return np.asarray([record[name] for record in self.records])[self.file_id]
+
+    def __len__(self):
+        return len(self.file_id)
+
+    def __getitem__(self, index):
+        # a single replicate gives its (shared) description dictionary, anything else a new description
+        if isinstance(index, (int, np.integer)):
+            return self.records[self.file_id[index]]
+        return ImaDescription(self.records, self.file_id[index])
+
+    def __iter__(self):
+        for i in self.file_id:
+            yield self.records[i]
+
+
+class ImaSampler:
+    """
+    Index sampler over the images of an ImaGene object: per-class buckets built once, stratified or class-balanced draws and splits w/ a seeded generator (indices only, to be used w/ subset or to index data)
+    """
+    def __init__(self, targets, seed=None):
+        """
+        Keyword Arguments:
+            targets (array) -- targets of an ImaGene object (class values, or one-hot rows after to_categorical)
+            seed (int) -- seed of the random generator
+        """
+        targets = np.asarray(targets)
+        labels = np.argmax(targets, axis=1) if targets.ndim == 2 else targets
+        self.classes, labels = np.unique(labels, return_inverse=True)
+        # images of class c are order[bounds[c]:bounds[c+1]]
+        self.order = np.argsort(labels, kind='stable')
+        self.bounds = np.searchsorted(labels[self.order], np.arange(len(self.classes) + 1))
+        self.rng = np.random.default_rng(seed)
+        return None
+
+    @property
+    def buckets(self):
+        """
+        Index of the images of each class
+        """
+        return [self.order[self.bounds[c]:self.bounds[c+1]] for c in range(len(self.classes))]
+
+    def __len__(self):
+        return len(self.order)
+
+    def stratified(self, size):
+        """
+        Draw size images w/o replacement, keeping class proportions (largest remainders for rounding)
+        """
+        sizes = self.bounds[1:] - self.bounds[:-1]
+        exact = sizes * size / len(self)
+        counts = np.floor(exact).astype('int')
+        counts[np.argsort(counts - exact, kind='stable')[:size - counts.sum()]] += 1
+        index = np.concatenate([self.rng.choice(bucket, count, replace=False) for bucket, count in zip(self.buckets, counts)])
+        return self.rng.permutation(index)
+
+    def balanced(self, size):
+        """
+        Draw size images w/ (nearly) the same nr per class, w/ replacement only for classes w/ too few images
+        """
+        counts = np.full(len(self.classes), size // len(self.classes))
+        counts[self.rng.choice(len(self.classes), size % len(self.classes), replace=False)] += 1
+        index = np.concatenate([self.rng.choice(bucket, count, replace=count > len(bucket)) for bucket, count in zip(self.buckets, counts)])
+        return self.rng.permutation(index)
+
+    def batches(self, batch_size=64, balanced=False, nr_batches=None):
+        """
+        Yield index minibatches: stratified w/o replacement through all images (one epoch), or class-balanced draws (nr_batches of them, by default as many as one epoch)
+        """
+        if nr_batches == None:
+            nr_batches = -(-len(self) // batch_size)
+        if balanced:
+            for i in range(nr_batches):
+                yield self.balanced(batch_size)
+        else:
+            index = self.stratified(len(self))
+            for i in range(0, min(len(index), nr_batches * batch_size), batch_size):
+                yield index[i:i+batch_size]
+
+    def split(self, fractions=(0.8, 0.1, 0.1)):
+        """
+        Split images into shuffled subsets (e.g. train, validation, test) w/ the same class proportions
+
+        Keyword Arguments:
+            fractions (list) -- fraction of images of each subset (normalised to sum to 1)
+
+        Returns:
+            list w/ the index array of each subset
+        """
+        cuts = np.cumsum(np.asarray(fractions, dtype='float64') / np.sum(fractions))[:-1]
+        subsets = [[] for fraction in fractions]
+        for bucket in self.buckets:
+            bucket = self.rng.permutation(bucket)
+            for subset, part in zip(subsets, np.split(bucket, np.round(cuts * len(bucket)).astype('int'))):
+                subset.append(part)
+        return [self.rng.permutation(np.concatenate(subset)) for subset in subsets]
+
+
 class ImaFile:
     """
     Parser for real data and simulations
@@ -254,7 +954,7 @@ class ImaFile:
 
         return desc
 
-    def read_simulations(self, parameter_name='selection_coeff_hetero', max_nrepl=None, verbose=0):
+    def read_simulations(self, parameter_name='selection_coeff_hetero', max_nrepl=None, verbose=0, n_workers=1):
         """
         Read simulations and store into compressed numpy arrays
 
@@ -262,6 +962,7 @@ class ImaFile:
             parameter_name: name of parameter to estimate
             max_nrepl: max nr of replicates per simulated msms file
             verbose: 
+            n_workers: nr of processes reading files in parallel, at most one per file (1 reads them one after another, w/o starting processes)
 
         Returns:
             an object of class Genes
@@ -269,116 +970,256 @@ class ImaFile:
 
         data = []
         positions = []
-        description = []
+        description = ImaDescription()
 
         # Open the directory in which simulation files are stored
-        for file_name in os.listdir(self.simulations_folder):
-
-            full_name = self.simulations_folder + '/%s' %(file_name)
+        full_names = [self.simulations_folder + '/%s' %(file_name) for file_name in os.listdir(self.simulations_folder)]
+
+        # idle workers would only cost start-up time and memory
+        n_workers = min(n_workers, len(full_names))
+        if n_workers > 1:
+            # workers hand haplotypes back through shared memory, results are merged in directory order
+            # workers are spawned, not forked: the caller may be training w/ TensorFlow in another thread (see Train_On_The_Fly.py), and forking a process whose TensorFlow/oneDNN threads are running can deadlock
+            resource_tracker.ensure_running()
+            with multiprocessing.get_context('spawn').Pool(n_workers) as pool:
+                tasks = [pool.apply_async(read_msms_shared, (full_name, self.nr_samples, max_nrepl)) for full_name in full_names]
+                pool.close()
+                try:
+                    for full_name, task in zip(full_names, tasks):
+                        first_line, block_name, nr_columns, pos = task.get()
+
+                        # Description for all simulations in this file, parsed once
+                        description.append(self.extract_description(full_name, first_line), len(nr_columns))
+
+                        block = shared_memory.SharedMemory(name=block_name)
+                        buffer = np.ndarray((self.nr_samples * sum(nr_columns),), dtype='uint8', buffer=block.buf)
+                        offset = 0
+                        for columns in nr_columns:
+                            size = self.nr_samples * columns
+                            data.append(buffer[offset:offset + size].reshape(self.nr_samples, columns, 1).copy())
+                            offset += size
+                        del buffer
+                        block.close()
+                        positions.extend(pos)
+
+                        if verbose > 0:
+                            print(full_name, ': ', len(nr_columns))
+                finally:
+                    # wait for all workers, then remove every block they created, also if a worker or the merge failed
+                    pool.join()
+                    for task in tasks:
+                        if task.successful():
+                            block = shared_memory.SharedMemory(name=task.get()[1])
+                            block.close()
+                            block.unlink()
 
-            if verbose > 0:
-                print(full_name, ': ', end='')
-
-            # Read lines including the metadata
-            f = gzip.open(full_name, 'rb')
-            file_content = f.read().decode('utf8').split('\n')
-
-            # Search the // char inside the file
-            starts = ([i for i, e in enumerate(file_content) if e == '//'])
-
-            # limit the scan to the first max_nrepl items (if set)
-            if max_nrepl!=None:
-                starts = starts[:max_nrepl]
-
-            if verbose > 0:
-                print(len(starts))
-
-            # Populate object with data for each simulated gene
-            for idx, pointer in enumerate(starts):
-
-                # Description for each simulation
-                description.append(self.extract_description(full_name, file_content[0]))
+        else:
+            for full_name in full_names:
 
-                nr_columns = int(file_content[pointer+1].split('segsites: ')[1])
-                haplotypes = np.zeros((self.nr_samples, nr_columns, 1), dtype='uint8')
-                pos = file_content[pointer+2].split(' ')
-                pos.pop()
-                pos.pop(0)
-                positions.append(np.asarray(pos, dtype='float32'))
-                del pos
+                if verbose > 0:
+                    print(full_name, ': ', end='')
 
-                for j in range(self.nr_samples):
+                # Stream the file, the first line includes the metadata
+                with gzip.open(full_name, 'rb') as f:
+                    first_line = f.readline().decode('utf8').rstrip('\r\n')
 
-                    hap = list(file_content[pointer + 3 + j])
+                    # Description for all simulations in this file, parsed once
+                    record = self.extract_description(full_name, first_line)
 
-                    # string processing: if not 0/1 --> convert to 1
-                    hap = ['1' if element!='0' and element!=1 else element for element in hap]
-                    # switch colours, 1s are black and 0s are white
-                    hap = ['255' if element=='1' else element for element in hap]
-                    haplotypes[j,:,0] = hap
+                    # Populate object with data for each simulated gene
+                    nr_read = 0
+                    for pos, haplotypes in stream_msms_replicates(f, self.nr_samples, max_nrepl):
+                        positions.append(pos)
+                        data.append(haplotypes)
+                        nr_read += 1
 
-                data.append(haplotypes)
+                description.append(record, nr_read)
 
-            f.close()
+                if verbose > 0:
+                    print(nr_read)
 
         gene = ImaGene(data=data, positions=positions, description=description, parameter_name=parameter_name)
 
         return gene
 
-    def read_VCF(self, verbose=0):
+    def stream_VCF(self, chunk_size=10000, verbose=0):
         """
-        Read VCF file and store into compressed numpy arrays
+        Read VCF file (plain, gzip or bgzip compressed) in chunks of sites, in bounded memory
+
+        Phased GT-only genotypes ('0|1') of a chunk are parsed at once as a fixed-width byte matrix; other chunks (extra FORMAT fields, unphased or missing genotypes) are parsed line by line.
 
         Keyword Arguments:
+            chunk_size: nr of sites per chunk
             verbose: 
 
-        Returns:
-            an object of class Genes
+        Yields:
+            positions (int32 numpy array) and haplotypes (uint8 numpy array (2 * nr individuals, nr sites, 1), 255 for allele 1) of each chunk
+        """
+        with open(self.VCF_file_name, 'rb') as f:
+            compressed = f.read(2) == b'\x1f\x8b'
+        # bgzip files are concatenated gzip blocks, readable as gzip
+        with (gzip.open(self.VCF_file_name, 'rb') if compressed else open(self.VCF_file_name, 'rb')) as f:
+            for line in f:
+                if not line.startswith(b'##'):
+                    break
+            header = line.rstrip(b'\r\n').split(b'\t')
+            ind_pos = header.index(b'POS')
+            ind_format = header.index(b'FORMAT')
+            nr_individuals = len(header) - ind_format - 1
+            if verbose == 1 or self.nr_samples != (nr_individuals*2):
+                print('Found ' + str(nr_individuals) + ' individuals.')
+
+            nr_sites = 0
+            while True:
+                lines = list(itertools.islice(f, chunk_size))
+                if len(lines) == 0:
+                    break
+                fields = [l.rstrip(b'\r\n').split(b'\t', ind_format + 1) for l in lines]
+                pos = np.array([field[ind_pos] for field in fields]).astype('int32')
+                genotypes = [field[-1] for field in fields]
+                haplotypes = np.zeros(((nr_individuals * 2), len(lines), 1), dtype='uint8')
+                # fixed width: nr_individuals times 'a|b' separated by tabs
+                width = 4 * nr_individuals
+                if all(len(genotype) == width - 1 for genotype in genotypes):
+                    matrix = np.frombuffer(b'\t'.join(genotypes) + b'\t', dtype='uint8').reshape(len(lines), width)
+                else:
+                    matrix = None
+                if matrix is not None and np.all(matrix[:, 1::4] == ord('|')) and np.all(matrix[:, 3::4] == ord('\t')):
+                    haplotypes[0::2, :, 0] = (matrix[:, 0::4] == ord('1')).T * np.uint8(255)
+                    haplotypes[1::2, :, 0] = (matrix[:, 2::4] == ord('1')).T * np.uint8(255)
+                else:
+                    for j in range(len(lines)):
+                        for i, genotype in enumerate(genotypes[j].split(b'\t')):
+                            alleles = genotype.split(b':')[0].replace(b'/', b'|').split(b'|')
+                            if alleles[0] == b'1':
+                                haplotypes[2*i, j] = 255
+                            if len(alleles) > 1 and alleles[1] == b'1':
+                                haplotypes[2*i + 1, j] = 255
+                nr_sites += len(lines)
+                yield pos, haplotypes
+
+            if verbose == 1:
+                print('Read ' + str(nr_sites) + ' sites.')
+
+    def windows_VCF(self, window, stride=None, unit='snp', chunk_size=10000):
         """
+        Slide windows along the VCF file, keeping only the sites of the current chunk (plus overlap) in memory
 
-        with open(self.VCF_file_name, 'r') as f:
-            lines = [l for l in f if not l.startswith('##')]
+        Windows are views on a rolling buffer of haplotypes, so overlapping windows share memory. With unit='snp', windows come from a strided sliding-window view and the last incomplete window is dropped.
 
-        header = lines.pop(0)
-        ind_pos = header.split('\t').index('POS')
-        ind_format = header.split('\t').index('FORMAT')
+        Keyword Arguments:
+            window: window size, in nr of sites (unit='snp') or bp (unit='bp')
+            stride: step between consecutive window starts, in the same unit (default: window, i.e. no overlap)
+            unit: either 'snp' or 'bp'
+            chunk_size: nr of sites read at once (see stream_VCF)
 
-        nr_individuals = len(header.split('\t')) - ind_format - 1
-        nr_sites = len(lines)
+        Yields:
+            haplotypes (uint8 view (nr haplotypes, nr sites, 1)), positions (view), start and end (bp) of each window w/ at least one site
+        """
+        if stride == None:
+            stride = window
+        haplotypes = None
+        start = None
+        skip = 0
+        chunks = itertools.chain(self.stream_VCF(chunk_size=chunk_size), [None])
+        for chunk in chunks:
+            if chunk != None:
+                pos, hap = chunk[0][skip:], chunk[1][:, skip:]
+                skip = max(skip - len(chunk[0]), 0)
+                if haplotypes is None:
+                    haplotypes, positions = hap, pos
+                    start = pos[0]
+                else:
+                    haplotypes = np.concatenate([haplotypes, hap], axis=1)
+                    positions = np.concatenate([positions, pos])
+            elif haplotypes is None:
+                return
+            if unit == 'snp':
+                if haplotypes.shape[1] < window:
+                    continue
+                views = np.lib.stride_tricks.sliding_window_view(haplotypes, window, axis=1)[:, ::stride]
+                position_views = np.lib.stride_tricks.sliding_window_view(positions, window)[::stride]
+                for w in range(views.shape[1]):
+                    yield views[:, w, 0, :, np.newaxis], position_views[w], position_views[w][0], position_views[w][-1]
+                first = views.shape[1] * stride
+                # w/ stride > window, sites between windows may not be read yet
+                skip = max(first - haplotypes.shape[1], 0)
+            else:
+                # complete windows only, except at the end of the file
+                while len(positions) > 0 and start <= positions[-1] and (chunk == None or start + window <= positions[-1]):
+                    i0, i1 = np.searchsorted(positions, [start, start + window])
+                    if i1 > i0:
+                        yield haplotypes[:, i0:i1], positions[i0:i1], start, start + window - 1
+                    start += stride
+                first = np.searchsorted(positions, start)
+            haplotypes, positions = haplotypes[:, first:], positions[first:]
+
+    def scan_VCF(self, model, window=192, stride=None, unit='snp', dimensions=(198, 192), minimal_maf=0.01, ordering='rows_freq', batch_size=64, chunk_size=10000, n_workers=1):
+        """
+        Score sliding windows along the VCF file w/ a trained model
 
-        if verbose == 1 | self.nr_samples!=(nr_individuals*2):
-            print('Found' + str(nr_individuals) + 'individuals and' + str(nr_sites) + 'sites.')
+        Windows are preprocessed as the synthetic training data (filter_freq, sort, resize, convert w/ flip) in batches by a pool of n_workers threads, while the model predicts the previous batches.
 
-        haplotypes = np.zeros(((nr_individuals * 2), nr_sites, 1), dtype='uint8')
+        Keyword Arguments:
+            model: trained Keras model
+            window, stride, unit: windows to score (see windows_VCF)
+            dimensions: nr of rows and columns the model was trained on
+            minimal_maf, ordering: preprocessing (see filter_freq and sort)
+            batch_size: nr of windows preprocessed and predicted at once
+            chunk_size: nr of sites read at once (see stream_VCF)
+            n_workers: nr of threads preprocessing batches
 
-        data = []
-        positions = []
-        pos = np.zeros((nr_sites), dtype='int32')
-
-        for j in range(nr_sites):
-            # populate genomic position
-            pos[j] = int(lines[j].split('\t')[ind_pos])
-            # extract genotypes
-            genotypes = lines[j].split('\t')[(ind_format+1):]
-            genotypes[len(genotypes) - 1] = genotypes[len(genotypes) - 1].split('\n')[0]
-            for i in range(len(genotypes)):
-                if i == 0:
-                    i1 = 0
-                    i2 = 1
-                else:
-                    i2 = i*2
-                    i1 = i2 - 1
-                if genotypes[i].split('|')[0] == '1':
-                    haplotypes[i1,j] = '255'
-                if genotypes[i].split('|')[1] == '1':
-                    haplotypes[i2,j] = '255'
+        Returns:
+            starts, ends (bp of ea window), scores (model output for ea window; 1D for models w/ a single output unit)
+        """
+        starts, ends, scores = [], [], []
+        windows = self.windows_VCF(window, stride=stride, unit=unit, chunk_size=chunk_size)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+            pending = collections.deque()
+            while True:
+                batch = list(itertools.islice(windows, batch_size))
+                if len(batch) > 0:
+                    future = executor.submit(preprocess_windows, [w[0] for w in batch], [w[1] for w in batch], dimensions, minimal_maf, ordering)
+                    pending.append((np.array([w[2] for w in batch]), np.array([w[3] for w in batch]), future))
+                # predict the oldest batch once enough batches are queued (or at the end of the file)
+                while len(pending) > (n_workers if len(batch) > 0 else 0):
+                    batch_starts, batch_ends, future = pending.popleft()
+                    keep, data = future.result()
+                    if len(data) == 0:
+                        continue
+                    starts.append(batch_starts[keep])
+                    ends.append(batch_ends[keep])
+                    scores.append(model.predict(data, batch_size=batch_size, verbose=0))
+                if len(batch) == 0:
+                    break
+        if len(scores) == 0:
+            print('No windows found.')
+            return np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64'), np.zeros(0, dtype='float32')
+        scores = np.concatenate(scores)
+        if scores.shape[1] == 1:
+            scores = scores[:, 0]
+        return np.concatenate(starts), np.concatenate(ends), scores
+
+    def read_VCF(self, verbose=0, chunk_size=10000):
+        """
+        Read VCF file (plain, gzip or bgzip compressed) and store into compressed numpy arrays
 
-        positions.append(pos)
-        data.append(haplotypes)
-        del pos
-        del haplotypes
+        Keyword Arguments:
+            verbose: 
+            chunk_size: nr of sites parsed at once (see stream_VCF)
 
-        gene = ImaGene(data=data, positions=positions)
+        Returns:
+            an object of class Genes
+        """
+        chunks = list(self.stream_VCF(chunk_size=chunk_size, verbose=verbose))
+        if len(chunks) == 0:
+            print('No sites found.')
+            return None
+        pos = np.concatenate([chunk[0] for chunk in chunks])
+        haplotypes = np.concatenate([chunk[1] for chunk in chunks], axis=1)
+        del chunks
+
+        gene = ImaGene(data=[haplotypes], positions=[pos])
 
         return gene
 
@@ -388,8 +1229,16 @@ class ImaGene:
     A batch of genomic images
     """
     def __init__(self, data, positions, description=[], targets=[], parameter_name=None, classes=[]):
+        # images with the same nr of rows are stored back to back in one buffer, split by columns
+        if type(data) == list and len(set((image.shape[0], image.shape[2], image.dtype) for image in data)) == 1:
+            data = RaggedArray.from_list(data, axis=1)
+            if type(positions) == list and len(positions) == len(data):
+                positions = RaggedArray.from_list(positions, axis=0)
         self.data = data
         self.positions = positions
+        # one description per replicate is stored as a shared per-file table
+        if not isinstance(description, ImaDescription):
+            description = ImaDescription.from_list(description)
         self.description = description
         self.dimensions = (np.zeros(len(self.data)), np.zeros(len(self.data)))
         # initialise dimensions to the first image (in case we have only one)
@@ -398,13 +1247,16 @@ class ImaGene:
         # if reads from real data, then stop here otherwise fill in all info on simulations
         if parameter_name != None:
             self.parameter_name = parameter_name # this is passed by ImaFile.read_simulations()
-            self.targets = np.zeros(len(self.data), dtype='int32')
-            for i in range(len(self.data)):
-                # set targets from file description
-                self.targets[i] = self.description[i][self.parameter_name]
-                # assign dimensions
-                self.dimensions[0][i] = self.data[i].shape[0]
-                self.dimensions[1][i] = self.data[i].shape[1]
+            # set targets from file description
+            self.targets = self.description.column(self.parameter_name).astype('int32')
+            # assign dimensions
+            if isinstance(self.data, RaggedArray):
+                self.dimensions[0][:] = self.data.buffer.shape[0]
+                self.dimensions[1][:] = self.data.lengths
+            else:
+                for i in range(len(self.data)):
+                    self.dimensions[0][i] = self.data[i].shape[0]
+                    self.dimensions[1][i] = self.data[i].shape[1]
             self.classes = np.unique(self.targets)
         return None
 
@@ -471,6 +1323,50 @@ class ImaGene:
 
         return 0
 
+    def ragged_views(self):
+        """
+        Images (concatenated along columns) and positions as RaggedArray, w/o changing self.data and self.positions (images or positions held as arrays or lists are copied into new buffers)
+
+        Returns:
+            data (RaggedArray), positions (RaggedArray)
+        """
+        self.materialise()
+        data, positions = self.data, self.positions
+        if not isinstance(data, RaggedArray):
+            data = RaggedArray.from_list(list(data), axis=1)
+        if not isinstance(positions, RaggedArray):
+            positions = RaggedArray.from_list(list(positions), axis=0)
+        return data, positions
+
+    def column_frequencies(self):
+        """
+        Frequency of the 255-valued allele at each column of all images, from integer sums on the uint8 data (no float copy of the images)
+
+        Keyword Arguments:
+
+        Returns:
+            frequencies (float64 array over the columns of all images, in order)
+        """
+        buffer = self.ragged_views()[0].buffer
+        sums = np.add.reduce(buffer[:,:,0], axis=0, dtype='uint32')
+        return sums / (255. * buffer.shape[0])
+
+    def index_sites(self):
+        """
+        Build a site index (allele counts of the 255-valued allele at every site, keyed by image and position) for vectorised frequency queries
+
+        Returns:
+            SiteIndex
+
+        Raises:
+            ValueError if positions do not match the columns of the images (e.g. after resizing)
+        """
+        data, positions = self.ragged_views()
+        if not np.array_equal(data.offsets, positions.offsets):
+            raise ValueError('Positions must match the columns of the images (index sites before resizing).')
+        counts = np.add.reduce(data.buffer[:,:,0] == 255, axis=0, dtype='uint32')
+        return SiteIndex(positions, counts, data.buffer.shape[0])
+
     def majorminor(self):
         """
         Convert to major/minor polarisation.
@@ -480,33 +1376,80 @@ class ImaGene:
         Returns:
             0
         """
-        for i in range(len(self.data)):
-            idx = np.where(np.mean(self.data[i][:,:,0]/255., axis=0) > 0.5)[0]
-            self.data[i][:,idx,0] = 255 - self.data[i][:,idx,0]
+        # all columns of all images at once, 255 - x is x ^ 255 for uint8
+        flip = (self.column_frequencies() > 0.5).astype('uint8') * 255
+        if isinstance(self.data, RaggedArray):
+            np.bitwise_xor(self.data.buffer, flip[np.newaxis,:,np.newaxis], out=self.data.buffer)
+        elif isinstance(self.data, np.ndarray):
+            # images of same shape, columns of image i are flip[i*nr_columns:(i+1)*nr_columns]
+            np.bitwise_xor(self.data, flip.reshape(len(self.data), 1, -1, 1), out=self.data)
+        else:
+            offsets = np.cumsum([0] + [image.shape[1] for image in self.data])
+            for i, image in enumerate(self.data):
+                np.bitwise_xor(image, flip[offsets[i]:offsets[i+1]][np.newaxis,:,np.newaxis], out=image)
         return 0
 
-    def filter_freq(self, minimal_maf, verbose=0):
+    def filter_freq(self, minimal_maf, majorminor=False, verbose=0, statistics=False):
         """
         Remove sites whose minor allele frequency is below the set threshold.
 
         Keyword Arguments:
             minimal_maf: minimal minor allele frequency to retain the site
+            majorminor: if True, also convert retained sites to major/minor polarisation in the same pass
+            statistics: if True, also calculate summary statistics on all sites (before filtering) from the same allele counts (see calculate_statistics)
 
         Returns:
             0
         """
-        for i in range(len(self.data)):
-            idx = np.where(np.mean(self.data[i][:,:,0]/255., axis=0) >= minimal_maf)[0]
-            self.positions[i] = self.positions[i][idx]
-            self.data[i] = self.data[i][:,idx,:]
-            # update nr of columns in dimensions
-            self.dimensions[1][i] = self.data[i].shape[1]
+        # filtered images are ragged, convert once (column_frequencies then reads the buffer w/o copying)
+        self.data, self.positions = self.ragged_views()
+        # all columns of all images at once
+        frequencies = self.column_frequencies()
+        if statistics == True:
+            self.calculate_statistics(counts=np.rint(frequencies * self.data.buffer.shape[0]).astype('int64'))
+        keep = frequencies >= minimal_maf
+        self.positions = self.positions.compress(keep)
+        self.data = self.data.compress(keep)
+        if majorminor == True:
+            flip = (frequencies[keep] > 0.5).astype('uint8') * 255
+            np.bitwise_xor(self.data.buffer, flip[np.newaxis,:,np.newaxis], out=self.data.buffer)
+        # update nr of columns in dimensions
+        self.dimensions[1][:] = self.data.lengths
+        if verbose > 0:
+            print('Retained %d of %d sites.' % (keep.sum(), len(keep)))
+        return 0
+
+    def calculate_statistics(self, counts=None, window=51):
+        """
+        Calculate summary statistics of each image, as baselines for the network, and store them in self.statistics
+
+        SFS, Watterson's, nucleotide-diversity and Fay & Wu's thetas, Tajima's D and Fay & Wu's H (see neutrality_statistics), treating the 255-valued allele as derived, and Garud's H1, H12 and H2/H1 in a window of sites around the selected position (see haplotype_homozygosity; the middle of the region for data w/o selection_position).
+
+        Keyword Arguments:
+            counts: derived allele count at each column (computed if not given)
+            window: nr of sites around the selected position for haplotype statistics
+
+        Returns:
+            0
+        """
+        data, positions = self.ragged_views()
+        nr_rows = data.buffer.shape[0]
+        if counts is None:
+            counts = np.add.reduce(data.buffer[:,:,0] == 255, axis=0, dtype='int64')
+        self.statistics = neutrality_statistics(counts, data.segment_ids(), len(data), nr_rows)
+        if all('selection_position' in record for record in self.description.records) and len(self.description) == len(data):
+            centres = self.description.column('selection_position').astype('float64')
+        else:
+            centres = np.array([(p[0] + p[-1]) / 2. if len(p) > 0 else 0. for p in positions])
+        self.statistics.update(haplotype_homozygosity(data, positions, centres, window))
         return 0
 
     def resize(self, dimensions=(128, 128), option=None, set_to_boundaries=True):
         """
         Resize all images to same dimensions.
 
+        With set_to_boundaries (the default), images of the same shape are resized together w/ two cached float32 weight matrices (see resize_weights) and thresholded at 128. Thresholding absorbs the float32 rounding, so output matches skimage.transform.resize unless a pixel lands within rounding of 128. Without it, each image is resized by skimage.transform.resize as before, because the float32 products differ from skimage's float64 values by 1 in a few % of pixels once truncated to uint8.
+
         Keyword Arguments:
             dimensions: tuple, nr of rows and nr of columns
             option: either 'mean', 'min' or 'max'
@@ -515,6 +1458,7 @@ class ImaGene:
         Returns:
             0
         """
+        self.materialise()
         if option == 'mean':
             dimensions = (int(self.dimensions[0].mean()), int(self.dimensions[1].mean()))
         elif option == 'min':
@@ -522,16 +1466,44 @@ class ImaGene:
         elif option == 'max':
             dimensions = (int(self.dimensions[0].max()), int(self.dimensions[1].max()))
         else: pass
-        for i in range(len(self.data)):
-            image = np.copy(self.data[i][:,:,0])
-            self.data[i] = np.zeros((dimensions[0], dimensions[1], 1), dtype='uint8')
-            self.data[i][:,:,0] = (skimage.transform.resize(image, dimensions, anti_aliasing=True, mode='reflect')*255).astype('uint8')
-            del image
-            # reassign data dimensions
-            self.dimensions[0][i] = self.data[i].shape[0]
-            self.dimensions[1][i] = self.data[i].shape[1]
-            if set_to_boundaries == True:
-                self.data[i] = (np.where(self.data[i] < 128, 0, 255)).astype('uint8')
+        dimensions = (int(dimensions[0]), int(dimensions[1]))
+        data = np.zeros((len(self.data), dimensions[0], dimensions[1], 1), dtype='uint8')
+        if set_to_boundaries == False:
+            # image by image, so that values are truncated from skimage's float64 output exactly
+            for i in range(len(self.data)):
+                data[i,:,:,0] = (skimage.transform.resize(np.asarray(self.data[i])[:,:,0], dimensions, anti_aliasing=True, mode='reflect')*255).astype('uint8')
+            self.data = data
+            self.dimensions[0][:] = dimensions[0]
+            self.dimensions[1][:] = dimensions[1]
+            return 0
+        # group images by shape, each group is resized with two cached weight matrices in float32
+        if isinstance(self.data, RaggedArray):
+            shapes = [(self.data.buffer.shape[0], columns) for columns in self.data.lengths]
+        else:
+            shapes = [self.data[i].shape[:2] for i in range(len(self.data))]
+        groups = {}
+        for i, shape in enumerate(shapes):
+            groups.setdefault(tuple(shape), []).append(i)
+        for (nr_rows, nr_columns), index in groups.items():
+            weights_rows = resize_weights(nr_rows, dimensions[0])
+            weights_columns = resize_weights(nr_columns, dimensions[1]).transpose()
+            for chunk in range(0, len(index), 256):
+                chunk_index = index[chunk:chunk + 256]
+                if isinstance(self.data, RaggedArray):
+                    columns = np.concatenate([np.arange(self.data.offsets[i], self.data.offsets[i+1]) for i in chunk_index])
+                    images = np.take(self.data.buffer[:,:,0], columns, axis=1).reshape(nr_rows, len(chunk_index), nr_columns).transpose(1, 0, 2)
+                else:
+                    images = np.stack([self.data[i][:,:,0] for i in chunk_index])
+                # values stay on the 0-255 scale, as image * 255 in skimage's [0,1] scale
+                resized = np.matmul(images.astype('float32'), weights_columns)
+                if nr_rows != dimensions[0]:
+                    resized = np.matmul(weights_rows, resized)
+                data[chunk_index,:,:,0] = np.where(resized < 128, 0, 255)
+                del images, resized
+        self.data = data
+        # reassign data dimensions
+        self.dimensions[0][:] = dimensions[0]
+        self.dimensions[1][:] = dimensions[1]
         return 0
 
     def sort(self, ordering):
@@ -544,90 +1516,189 @@ class ImaGene:
         Returns:
             0
         """
-        if ordering == 'rows_freq':
-            for i in range(len(self.data)):
-                uniques, counts = np.unique(self.data[i], return_counts=True, axis=0)
-                counter = 0
-                for j in counts.argsort()[::-1]:
-                    for z in range(counts[j]):
-                        self.data[i][counter,:,:] = uniques[j,:,:]
-                        counter += 1
-        elif ordering == 'cols_freq':
-            for i in range(len(self.data)):
-                uniques, counts = np.unique(self.data[i], return_counts=True, axis=1)
-                counter = 0 #
-                for j in counts.argsort()[::-1]:
-                    for z in range(counts[j]):
-                        self.data[i][:,counter,:] = uniques[:,j,:]
-                        counter += 1
-        elif ordering == 'rows_dist':
-            for i in range(len(self.data)):
-                uniques, counts = np.unique(self.data[i], return_counts=True, axis=0)
+        self.materialise()
+        if ordering not in ['rows_freq', 'cols_freq', 'rows_dist', 'cols_dist']:
+            print('Select a valid ordering.')
+            return 1
+        # black and white images in one buffer are sorted in batch on bit-packed keys
+        if isinstance(self.data, RaggedArray) and self.data.buffer.dtype == 'uint8':
+            buffer = self.data.buffer
+            if not np.any((buffer != 0) & (buffer != 255)):
+                self.sort_packed(ordering)
+                return 0
+        axis = 0 if ordering.startswith('rows') else 1
+        for i in range(len(self.data)):
+            uniques, counts = np.unique(self.data[i], return_counts=True, axis=axis)
+            if ordering.endswith('freq'):
+                order = counts.argsort()[::-1]
+            elif axis == 0:
                 # most frequent row in float
                 top = uniques[counts.argsort()[::-1][0]].transpose().astype('float32')
                 # distances from most frequent row
-                distances = np.mean(np.abs(uniques[:,:,0] - top), axis=1)
-                # fill in from top to bottom
-                counter = 0
-                for j in distances.argsort():
-                    for z in range(counts[j]):
-                        self.data[i][counter,:,:] = uniques[j,:,:]
-                        counter += 1
-        elif ordering == 'cols_dist':
-            for i in range(len(self.data)):
-                uniques, counts = np.unique(self.data[i], return_counts=True, axis=1)
+                order = np.mean(np.abs(uniques[:,:,0] - top), axis=1).argsort()
+            else:
                 # most frequent column
                 top = uniques[:,counts.argsort()[::-1][0]].astype('float32')
                 # distances from most frequent column
-                distances = np.mean(np.abs(uniques[:,:,0] - top), axis=0)
-                # fill in from left to right
-                counter = 0
-                for j in distances.argsort():
-                    for z in range(counts[j]):
-                        self.data[i][:,counter,:] = uniques[:,j,:]
-                        counter += 1
+                order = np.mean(np.abs(uniques[:,:,0] - top), axis=0).argsort()
+            # fill in from top to bottom (left to right)
+            self.data[i][:] = np.repeat(np.take(uniques, order, axis=axis), counts[order], axis=axis)
+        return 0
+
+    def sort_packed(self, ordering):
+        """
+        Sort rows and/or columns of all images at once, for images of 0s and 255s stored in one ragged buffer. Same output as sort.
+
+        Rows (or columns) are packed into uint64 words, unique keys are found for the whole batch with one lexsort and each image is written back with one gather.
+
+        Keyword Arguments:
+            ordering: either 'rows_freq', 'cols_freq', 'rows_dist', 'cols_dist'
+
+        Returns:
+            0
+        """
+        buffer = self.data.buffer
+        nr_rows = buffer.shape[0]
+        offsets = self.data.offsets
+        lengths = self.data.lengths
+        nr_images = len(lengths)
+        by_rows = ordering.startswith('rows')
+
+        if by_rows:
+            # pad each image to a multiple of 8 columns so that packed bytes do not straddle images
+            padded = np.zeros(nr_images + 1, dtype='int64')
+            np.cumsum((lengths + 7) // 8 * 8, out=padded[1:])
+            bits = np.zeros((nr_rows, padded[-1]), dtype='bool')
+            bits[:, np.repeat(padded[:-1] - offsets[:-1], lengths) + np.arange(offsets[-1])] = buffer[:,:,0] != 0
+            packed = np.packbits(bits, axis=1)
+            del bits
+            nr_bytes = np.diff(padded) // 8
+            byte_offsets = padded // 8
+            keys = np.zeros((nr_images, nr_rows, max(-(-nr_bytes.max() // 8) * 8, 8)), dtype='uint8')
+            keys[np.repeat(np.arange(nr_images), nr_bytes), :, np.arange(byte_offsets[-1]) - np.repeat(byte_offsets[:-1], nr_bytes)] = packed.T
+            del packed
+            words = keys.reshape(nr_images * nr_rows, -1).view('>u8').astype('uint64')
+            del keys
+            groups = np.repeat(np.arange(nr_images), nr_rows)
+            first, counts, unique_groups = group_uniques(words, groups)
+            local = first - unique_groups * nr_rows
         else:
-            print('Select a valid ordering.')
-            return 1
+            words = pack_words((buffer[:,:,0] != 0).transpose())
+            first, counts, unique_groups = group_uniques(words, self.data.segment_ids())
+            local = first - offsets[unique_groups]
+        unique_words = words[first]
+        del words
+
+        unique_offsets = np.zeros(nr_images + 1, dtype='int64')
+        np.cumsum(np.bincount(unique_groups, minlength=nr_images), out=unique_offsets[1:])
+        if not by_rows:
+            columns = np.zeros(offsets[-1], dtype='int64')
+
+        for i in range(nr_images):
+            start, end = unique_offsets[i], unique_offsets[i+1]
+            image_counts = counts[start:end]
+            if ordering.endswith('freq'):
+                order = image_counts.argsort()[::-1]
+            else:
+                # distances from most frequent row (column) as in sort, via popcount of differing bits
+                top = start + image_counts.argsort()[::-1][0]
+                differences = count_bits(unique_words[start:end] ^ unique_words[top]).sum(axis=1, dtype='int64')
+                distances = (differences * 255).astype('float32')
+                distances /= max(lengths[i] if by_rows else nr_rows, 1)
+                order = distances.argsort()
+            source = np.repeat(local[start:end][order], image_counts[order])
+            if by_rows:
+                self.data[i][:] = self.data[i][source]
+            else:
+                columns[offsets[i]:offsets[i+1]] = offsets[i] + source
+
+        if not by_rows:
+            self.data.buffer = np.take(buffer, columns, axis=1)
         return 0
 
-    def convert(self, normalise=False, flip=False, verbose=False):
+    def convert(self, normalise=False, flip=False, verbose=False, dtype='float32'):
         """
         Check for correct data type and convert otherwise. Convert to float numpy arrays [0,1] too. If flip true, then flips 0-1
+
+        The output is allocated once and scaled and flipped in place (a list of images is filled, scaled and flipped in a single pass through a lookup table). With dtype='uint8' images stay as 0-255 integers (flipped to 255-x) and scaling is left to the input layer of the model.
         """
+        self.materialise()
         # if list, put is as numpy array
-        if type(self.data) == list:
+        if type(self.data) != np.ndarray:
             if len(np.unique(self.dimensions[0]))*len(np.unique(self.dimensions[1])) == 1:
                 if verbose:
                     print('Converting to numpy array.')
-                self.data = np.asarray(self.data)
+                images = list(self.data)
+                source_dtype = images[0].dtype
             else:
                 print('Aborted. All images must have the same shape.')
                 return 1
-        # if unit8, put it as float and divide by 255
-        if self.data.dtype == 'uint8':
+        else:
+            images = self.data
+            source_dtype = images.dtype
+        shape = (len(images),) + images[0].shape
+        flipped = False
+        # keep as uint8
+        if dtype == 'uint8':
+            if source_dtype != 'uint8' or normalise == True:
+                print('Aborted. Only uint8 images without normalisation can be kept as uint8.')
+                return 1
+            if type(images) == list:
+                self.data = np.empty(shape, dtype='uint8')
+                for i in range(len(images)):
+                    self.data[i] = images[i]
+            if flip == True:
+                if verbose:
+                    print('Flipping values.')
+                # 255 - x is x ^ 255 for uint8
+                np.bitwise_xor(self.data, 255, out=self.data)
+                flipped = True
+        # if unit8 array, put it as float (one allocation) and divide by 255 in place
+        elif source_dtype == 'uint8' and type(images) != list:
             if verbose:
                 print('Converting to float32.')
-            self.data = self.data.astype('float32')
-        if self.data.max() > 1:
+            self.data = images.astype('float32')
+            if images.max() > 1:
+                if verbose:
+                    print('Converting to [0,1].')
+                np.divide(self.data, 255., out=self.data)
+        # if list of unit8 images, fill one float array image by image through a lookup table of the 256 possible values (scaled and flipped)
+        elif source_dtype == 'uint8':
             if verbose:
-                print('Converting to [0,1].')
-            self.data /= 255.
+                print('Converting to float32.')
+            table = np.arange(256, dtype='float32')
+            if max([image.max() for image in images]) > 1:
+                if verbose:
+                    print('Converting to [0,1].')
+                table /= 255.
+            if flip == True and normalise == False:
+                if verbose:
+                    print('Flipping values.')
+                table = 1. - table
+                flipped = True
+            self.data = np.empty(shape, dtype='float32')
+            for i in range(len(images)):
+                np.take(table, images[i], out=self.data[i])
+        else:
+            self.data = np.asarray(images)
+            if self.data.max() > 1:
+                if verbose:
+                    print('Converting to [0,1].')
+                self.data /= 255.
         # normalise
         if normalise==True:
             if verbose:
                 print('Normalising samplewise.')
+            # image by image, each image is large and stays in cache
             for i in range(len(self.data)):
-                mean = self.data[i].mean()
-                std = self.data[i].std()
+                mean, std = self.data[i].mean(), self.data[i].std()
                 self.data[i] -= mean
                 self.data[i] /= std
         # flip
-        if flip==True:
+        if flip==True and flipped == False:
             if verbose:
                 print('Flipping values.')
-            for i in range(len(self.data)):
-                self.data[i] = 1. - self.data[i]
+            np.subtract(1., self.data, out=self.data)
         if verbose:
             if self.data.shape[0] > 1: 
                 print('A numpy array with dimensions', self.data.shape, 'and', len(self.targets), 'targets and', len(self.classes), 'classes.')
@@ -640,10 +1711,8 @@ class ImaGene:
         Set classes (or reinitiate)
         """
         # at each call reinitialise for safety
-        targets = np.zeros(len(self.data), dtype='int32')
-        for i in range(len(self.data)):
-            # set target from file description
-            targets[i] = self.description[i][self.parameter_name]
+        # set target from file description
+        targets = self.description.column(self.parameter_name).astype('int32')
         self.classes = np.unique(targets)
         # calculate and/or assign new classes
         if nr_classes > 0:
@@ -658,88 +1727,406 @@ class ImaGene:
         Set targets for binary or categorical classification (not for regression) AFTER running set_classes
         """
         # initialise
-        self.targets = np.zeros(len(self.data), dtype='int32')
-        for i in range(len(self.targets)):
-            # reinitialise
-            self.targets[i] = self.description[i][self.parameter_name]
-            # assign label as closest class
-            self.targets[i] = self.classes[np.argsort(np.abs(self.targets[i] - self.classes))[0]]
+        self.targets = self.description.column(self.parameter_name).astype('int32')
+        # assign label as closest class (the first one listed in classes if two are as close)
+        classes = np.asarray(self.classes)
+        order = np.argsort(classes, kind='stable')
+        values = classes[order]
+        after = np.minimum(np.searchsorted(values, self.targets), len(values) - 1)
+        before = np.searchsorted(values, values[np.maximum(after - 1, 0)])
+        distance_after = np.abs(self.targets - values[after])
+        distance_before = np.abs(self.targets - values[before])
+        closest = np.where((distance_after < distance_before) | ((distance_after == distance_before) & (order[after] < order[before])), after, before)
+        self.targets[:] = values[closest]
         return 0
 
-    def subset(self, index):
+    def subset(self, index, lazy=False):
         """
         Subset object to index array (for shuffling or only for multiclassification after setting classes and targets)
+
+        If lazy, images and positions only record the index (composed w/ any earlier lazy subset) and are gathered in one go by materialise, which methods that need contiguous data call first.
         """
         # update based on index
         self.targets = self.targets[index]
-        self.data = self.data[index]
-        self.positions = [self.positions[i] for i in index]
-        self.description = [self.description[i] for i in index]
-        for i in range(len(self.data)):
-            self.dimensions[0][i] = self.data[i].shape[0]
-            self.dimensions[1][i] = self.data[i].shape[1]
+        self.data = IndexView(self.data, index)
+        self.positions = IndexView(self.positions, index)
+        self.description = self.description[index]
+        self.dimensions = (self.dimensions[0][index], self.dimensions[1][index])
+        if hasattr(self, 'statistics'):
+            self.statistics = {name: values[index] for name, values in self.statistics.items()}
+        if lazy == False:
+            self.materialise()
         return 0
 
-    def save(self, file):
+    def materialise(self):
+        """
+        Gather images and positions selected by lazy subsets
+        """
+        if isinstance(self.data, IndexView):
+            self.data = self.data.materialise()
+        if isinstance(self.positions, IndexView):
+            self.positions = self.positions.materialise()
+        return 0
+
+    def columns(self):
+        """
+        Arrays (all but the images) and JSON metadata needed to rebuild the object, as saved by save
+        """
+        self.materialise()
+        arrays = {'positions': self.positions, 'dimensions': np.asarray(self.dimensions), 'description_file_id': self.description.file_id}
+        if type(self.positions) == list:
+            arrays['positions'] = RaggedArray.from_list(self.positions, axis=0)
+        for name in ['targets', 'classes']:
+            if hasattr(self, name):
+                arrays[name] = getattr(self, name)
+        for name, values in getattr(self, 'statistics', {}).items():
+            arrays['statistics_' + name] = values
+        attributes = {}
+        if hasattr(self, 'parameter_name'):
+            attributes['parameter_name'] = self.parameter_name
+        return arrays, {'attributes': attributes, 'description': self.description.records}
+
+    def save(self, file, format='pickle', chunk_size=256):
         """
         Save to file
+
+        Keyword Arguments:
+            file: file name (pickle) or folder name (npy, store)
+            format: 'pickle' (the whole object), 'npy' (one .npy file per array plus a JSON sidecar, for memory-mapped loading with load_imagene) or 'store' (binary images bit-packed in compressed chunks, see ImaGeneStore)
+            chunk_size: nr of images per compressed chunk (store only)
         """
-        with open(file, 'wb') as fp:
-            pickle.dump(self, fp)
+        self.materialise()
+        if format == 'pickle':
+            with open(file, 'wb') as fp:
+                pickle.dump(self, fp)
+            return 0
+        elif format not in ['npy', 'store']:
+            print('Select a valid format.')
+            return 1
+
+        if format == 'store':
+            if type(self.data) != np.ndarray:
+                print('Aborted. All images must have the same shape and be converted to a numpy array.')
+                return 1
+            low, high = self.data.min(), self.data.max()
+            if any(np.count_nonzero((self.data[i:i+chunk_size] != low) & (self.data[i:i+chunk_size] != high)) for i in range(0, len(self.data), chunk_size)):
+                print('Aborted. Only binary images (e.g. resized with set_to_boundaries=True) can be stored.')
+                return 1
+            ImaGeneStore.write(self, file, chunk_size=chunk_size)
+            return 0
+
+        os.makedirs(file, exist_ok=True)
+        arrays, meta = self.columns()
+        # images of different shapes are saved as a ragged array
+        arrays['data'] = RaggedArray.from_list(self.data, axis=1) if type(self.data) == list else self.data
+        meta['format'] = 'npy'
+        meta['layout'] = save_arrays(file, arrays)
+        with open(os.path.join(file, 'meta.json'), 'w') as fp:
+            json.dump(meta, fp, indent=1)
         return 0
 
     def crop(self, window):
         """
         crop or extend haplotype window for genomic image object. Window size are adjusted from center
 
+        All images are written into one preallocated array of their dtype, w/ one trim/pad plan per distinct width. Images wider than window keep the centred columns (odd widths as if extended by an empty column on the right), narrower ones are centred w/ (window - width) // 2 empty columns on the left and zeros up to window on the right, so that every output is exactly window wide.
+
         Arguments:
             window: haplotype window size
 
+        Returns:
+            0
         """
+        self.materialise()
+        if isinstance(self.data, RaggedArray):
+            buffer = self.data.buffer
+            nr_rows, nr_channels, dtype = buffer.shape[0], buffer.shape[2], buffer.dtype
+            widths = self.data.lengths
+        else:
+            if len(set((image.shape[0], image.shape[2]) for image in self.data)) > 1:
+                print('Aborted. All images must have the same nr of rows and channels.')
+                return 1
+            nr_rows, nr_channels, dtype = self.data[0].shape[0], self.data[0].shape[2], self.data[0].dtype
+            widths = np.array([image.shape[1] for image in self.data])
+        cropped = np.zeros((len(widths), nr_rows, window, nr_channels), dtype=dtype)
+
+        for y in np.unique(widths):
+            index = np.flatnonzero(widths == y)
+            # plan: copy columns [source, source + length) of the image to [target, target + length) of the window
+            if window < y:
+                source, target = y // 2 - window // 2, 0
+                length = min(window, y - source)
+            else:
+                source, target = 0, (window - y) // 2
+                length = y
+            if isinstance(self.data, RaggedArray):
+                columns = self.data.offsets[index][:, np.newaxis] + source + np.arange(length)
+                cropped[index, :, target:target + length] = np.moveaxis(np.take(buffer, columns, axis=1), 0, 1)
+            elif isinstance(self.data, np.ndarray):
+                cropped[index, :, target:target + length] = self.data[index, :, source:source + length]
+            else:
+                for i in index:
+                    cropped[i, :, target:target + length] = self.data[i][:, source:source + length]
 
-        for i, image in enumerate(self.data):
-            x, y, c = image.shape[0], image.shape[1], image.shape[2]
+        self.data = cropped
+        #update dimension
+        self.dimensions[0][:] = nr_rows
+        self.dimensions[1][:] = window
+        return 0
 
-            if y == window:
-                continue
-            
-            #when even no. haplotype column
-            if y % 2 == 0:
-                if window < y:
-                    starty = y // 2 - window // 2
-                    self.data[i] = image[:, starty:starty + window, :]
 
-                #perform padding
-                else:
-                    padding_len = (window - y) // 2
-                    padding = np.zeros((x, padding_len, c))
-                    self.data[i] = np.concatenate((padding, image, padding), axis=1)
-            
-            #when odd no.haplotype column
-            #will result in slight offset for window by padding a empty padding on the right hand side
+class ImaGeneStore:
+    """
+    Binary images bit-packed into fixed-size zlib-compressed chunks, with an index of chunk offsets for random access to any replicate
+
+    A store is a folder with chunks.bin (the compressed chunks back to back), index.npy (byte offset of each chunk), the other arrays of the ImaGene object as .npy files and meta.json.
+    """
+    def __init__(self, folder, cache_size=8):
+        self.folder = folder
+        with open(os.path.join(folder, 'meta.json'), 'r') as fp:
+            self.meta = json.load(fp)
+        self.index = np.load(os.path.join(folder, 'index.npy'))
+        self.arrays = load_arrays(folder, self.meta['layout'])
+        self.shape = tuple(self.meta['shape'])
+        self.chunk_size = self.meta['chunk_size']
+        # pixel value of bits 0 and 1
+        self.values = np.asarray(self.meta['values'], dtype=self.meta['dtype'])
+        self.chunks = np.memmap(os.path.join(folder, 'chunks.bin'), dtype='uint8', mode='r') if self.index[-1] > 0 else None
+        self.cache_size = cache_size
+        self.cache = {}
+        return None
+
+    @classmethod
+    def write(cls, gene, folder, chunk_size=256, level=6):
+        """
+        Write the (binary, same-shape) images and all other arrays of an ImaGene object to a new store
+
+        Keyword Arguments:
+            gene (ImaGene) -- object to store
+            folder (string) -- folder of the store
+            chunk_size (int) -- nr of images per compressed chunk
+            level (int) -- zlib compression level
+
+        Returns:
+            ImaGeneStore opened on the new folder
+        """
+        os.makedirs(folder, exist_ok=True)
+        data = gene.data
+        high = data.max() if len(data) > 0 else 1
+        index = np.zeros((len(data) + chunk_size - 1) // chunk_size + 1, dtype='int64')
+        with open(os.path.join(folder, 'chunks.bin'), 'wb') as fp:
+            for c, i in enumerate(range(0, len(data), chunk_size)):
+                chunk = np.asarray(data[i:i+chunk_size]).reshape(min(chunk_size, len(data) - i), -1)
+                buffer = zlib.compress(np.packbits(chunk == high, axis=1).tobytes(), level)
+                fp.write(buffer)
+                index[c+1] = index[c] + len(buffer)
+        np.save(os.path.join(folder, 'index.npy'), index)
+        arrays, meta = gene.columns()
+        meta['format'] = 'store'
+        meta['layout'] = save_arrays(folder, arrays)
+        meta['shape'] = list(data.shape[1:])
+        meta['dtype'] = str(data.dtype)
+        meta['values'] = [data.min().item(), high.item()] if len(data) > 0 else [0, 1]
+        meta['chunk_size'] = chunk_size
+        meta['nr_images'] = len(data)
+        with open(os.path.join(folder, 'meta.json'), 'w') as fp:
+            json.dump(meta, fp, indent=1)
+        return cls(folder)
+
+    def read_packed(self, c, keep=None):
+        """
+        Decompress one chunk into bit-packed images, one row of bytes per image (no cache, so safe to call from several threads)
+
+        Keyword Arguments:
+            c (int) -- chunk
+            keep (array) -- boolean mask of the images of the chunk to return (all by default)
+        """
+        nr_pixels = int(np.prod(self.shape))
+        packed = np.frombuffer(zlib.decompress(self.chunks[self.index[c]:self.index[c+1]]), dtype='uint8').reshape(-1, (nr_pixels + 7) // 8)
+        return packed if keep is None else packed[keep]
+
+    def unpack(self, packed):
+        """
+        Expand bit-packed images (see read_packed) to pixel values
+        """
+        nr_pixels = int(np.prod(self.shape))
+        bits = np.unpackbits(packed, axis=1, count=nr_pixels)
+        return self.values[bits].reshape((-1,) + self.shape)
+
+    def decompress_chunk(self, c, keep=None):
+        """
+        Decompress and unpack one chunk, or the images of it selected by the boolean mask keep (no cache, so safe to call from several threads)
+        """
+        return self.unpack(self.read_packed(c, keep))
+
+    def read_chunk(self, c):
+        """
+        Decompress and unpack one chunk, keeping the last cache_size chunks in memory
+        """
+        if c not in self.cache:
+            if len(self.cache) >= self.cache_size:
+                self.cache.pop(next(iter(self.cache)))
+            self.cache[c] = self.decompress_chunk(c)
+        return self.cache[c]
+
+    def __len__(self):
+        return self.meta['nr_images']
+
+    def __getitem__(self, index):
+        # a single image, or a stack of images decompressing each chunk they come from once
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            return self.read_chunk(index // self.chunk_size)[index % self.chunk_size]
+        index = np.arange(len(self))[index]
+        images = np.empty((len(index),) + self.shape, dtype=self.values.dtype)
+        chunk_id = index // self.chunk_size
+        for c in np.unique(chunk_id):
+            selected = chunk_id == c
+            images[selected] = self.read_chunk(c)[index[selected] % self.chunk_size]
+        return images
+
+    def to_imagene(self, index=None):
+        """
+        Read the selected replicates (all by default) into an ImaGene object
+        """
+        if index is None:
+            index = np.arange(len(self))
+        index = np.arange(len(self))[index]
+        arrays = {}
+        for name, array in self.arrays.items():
+            if name == 'dimensions':
+                arrays[name] = array[:, index]
+            elif name in ['positions', 'targets', 'description_file_id'] or name.startswith('statistics_'):
+                arrays[name] = array[index]
             else:
-                offset_padding = np.zeros((x, 1, c))
-                image = np.concatenate((image, offset_padding), axis = 1)
-                #perform cropping
-                if window < y:
-                    starty = y // 2 - window // 2
-                    self.data[i] = image[:, starty:starty + window, :]
-
-                #perform padding
-                else:
-                    padding_len = (window - y) // 2
-                    padding = np.zeros((x, padding_len, c))
-                    self.data[i] = np.concatenate((padding, image, padding), axis=1)
+                arrays[name] = array
+        return build_imagene(self[index], arrays, self.meta)
+
+    def batches(self, batch_size=32, shuffle=True, seed=None):
+        """
+        Yield (images, targets) minibatches, in a shuffled order if required
+        """
+        order = np.random.default_rng(seed).permutation(len(self)) if shuffle else np.arange(len(self))
+        targets = self.arrays.get('targets')
+        for i in range(0, len(order), batch_size):
+            index = order[i:i+batch_size]
+            yield self[index], (targets[index] if targets is not None else None)
 
 
-            #update dimension
-            self.dimensions[0][i] = self.data[i].shape[0]
-            self.dimensions[1][i] = self.data[i].shape[1]
+class ImaMetrics:
+    """
+    Test metrics accumulated one chunk of predictions at a time: confusion counts, loss, calibration bins and score histograms for ROC/PR curves
 
+    Only counts and sums are kept, so memory does not grow w/ the test set, and accumulators of different chunks or processes can be merged.
+    """
+    def __init__(self, classes, nr_bins=10, nr_thresholds=1000, epsilon=1e-7):
+        """
+        Keyword Arguments:
+            classes (array) -- class values (labels of the confusion matrix)
+            nr_bins (int) -- nr of confidence bins for calibration
+            nr_thresholds (int) -- nr of score bins for ROC/PR curves
+            epsilon (float) -- probabilities are clipped to [epsilon, 1 - epsilon] for the loss (as Keras does)
+        """
+        self.classes = np.asarray(classes)
+        nr_classes = max(len(self.classes), 2)
+        self.confusion = np.zeros((nr_classes, nr_classes), dtype='int64') # rows true, columns predicted
+        self.nr_images = 0
+        self.loss_sum = 0.
+        self.regularisation = 0. # added to the loss, e.g. sum(model.losses)
+        self.epsilon = epsilon
+        # per confidence bin: nr of images, sum of confidences, nr of correct predictions
+        self.calibration = np.zeros((3, nr_bins))
+        # per score bin: nr of negatives, nr of positives (score of class 1 for binary, one-vs-rest scores of all classes otherwise)
+        self.histograms = np.zeros((2, nr_thresholds), dtype='int64')
         return None
 
-            
-                
+    def update(self, targets, probs):
+        """
+        Add a chunk of predictions
+
+        Keyword Arguments:
+            targets (array) -- 0/1 targets (binary) or one-hot rows (multiclass)
+            probs (array) -- predicted probabilities, (nr images,) or (nr images, 1) for binary, (nr images, nr classes) otherwise
+
+        Returns:
+            0
+        """
+        targets = np.asarray(targets)
+        probs = np.asarray(probs, dtype='float64')
+        epsilon = self.epsilon
+        if targets.ndim == 1:
+            probs = probs.reshape(len(probs))
+            true = targets.astype('int64')
+            predicted = np.where(probs < 0.5, 0, 1)
+            clipped = np.clip(probs, epsilon, 1 - epsilon)
+            self.loss_sum -= np.sum(true * np.log(clipped + epsilon) + (1 - true) * np.log(1 - clipped + epsilon))
+            confidence = np.where(predicted == 1, probs, 1 - probs)
+            scores, positives = probs, true.astype('bool')
+        else:
+            true = np.argmax(targets, axis=1)
+            predicted = np.argmax(probs, axis=1)
+            clipped = np.clip(probs / probs.sum(axis=1, keepdims=True), epsilon, 1 - epsilon)
+            self.loss_sum -= np.sum(targets * np.log(clipped))
+            confidence = probs[np.arange(len(probs)), predicted]
+            scores, positives = probs.ravel(), targets.ravel().astype('bool')
+        nr_classes = len(self.confusion)
+        self.confusion += np.bincount(true * nr_classes + predicted, minlength=nr_classes**2).reshape(nr_classes, nr_classes)
+        self.nr_images += len(true)
+        nr_bins = self.calibration.shape[1]
+        bins = np.minimum((confidence * nr_bins).astype('int64'), nr_bins - 1)
+        self.calibration[0] += np.bincount(bins, minlength=nr_bins)
+        self.calibration[1] += np.bincount(bins, weights=confidence, minlength=nr_bins)
+        self.calibration[2] += np.bincount(bins, weights=(true == predicted), minlength=nr_bins)
+        nr_thresholds = self.histograms.shape[1]
+        bins = np.clip((scores * nr_thresholds).astype('int64'), 0, nr_thresholds - 1)
+        self.histograms += np.bincount(bins * 2 + positives, minlength=2 * nr_thresholds).reshape(nr_thresholds, 2).T
+        return 0
+
+    def merge(self, other):
+        """
+        Add the counts of another accumulator (e.g. from another chunk or process)
+        """
+        self.confusion += other.confusion
+        self.nr_images += other.nr_images
+        self.loss_sum += other.loss_sum
+        self.calibration += other.calibration
+        self.histograms += other.histograms
+        return 0
+
+    @property
+    def accuracy(self):
+        return np.trace(self.confusion) / max(self.nr_images, 1)
+
+    @property
+    def loss(self):
+        return self.loss_sum / max(self.nr_images, 1) + self.regularisation
+
+    def calibration_curve(self):
+        """
+        Mean confidence and accuracy in each non-empty confidence bin, w/ the nr of images in it
+        """
+        counts = self.calibration[0]
+        filled = counts > 0
+        return self.calibration[1][filled] / counts[filled], self.calibration[2][filled] / counts[filled], counts[filled]
+
+    def roc_curve(self):
+        """
+        False and true positive rates at decreasing score thresholds, w/ the area under the curve
+        """
+        negatives, positives = np.cumsum(self.histograms[:,::-1], axis=1)
+        fpr = np.concatenate([[0.], negatives / max(negatives[-1], 1)])
+        tpr = np.concatenate([[0.], positives / max(positives[-1], 1)])
+        return fpr, tpr, np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2)
+
+    def pr_curve(self):
+        """
+        Precision and recall at decreasing score thresholds (only where some image is predicted positive)
+        """
+        negatives, positives = np.cumsum(self.histograms[:,::-1], axis=1)
+        predicted = negatives + positives
+        filled = predicted > 0
+        return positives[filled] / predicted[filled], positives[filled] / max(positives[-1], 1)
 
 
 class ImaNet:
@@ -751,15 +2138,16 @@ class ImaNet:
         self.scores = {'val_loss': [], 'val_accuracy': [], 'loss': [], 'accuracy': [], 'mae': [], 'val_mae': []}
         self.test = np.zeros(2)
         self.values = None # matrix(3,nr_test) true, map, mle
+        self.metrics = None # ImaMetrics of the last test set
         return None
 
     def update_scores(self, score):
         """
-        Append new scores after each training
+        Append new scores (one per epoch) after each training
         """
         for key in self.scores.keys():
             if key in score.history:
-                self.scores[key].append(score.history[key])
+                self.scores[key].extend(score.history[key])
         return 0
 
     def plot_train(self, file=None):
@@ -802,22 +2190,32 @@ class ImaNet:
 
         return 0
 
-    def predict(self, gene, model):
+    def predict(self, gene, model, chunk_size=1024):
         """
         Calculate predicted values (many, I assume this is for testing not for single prediction); output is a matrix with rnows=2, row 0 is true, row 1 is MAP, row 2 is posterior mean
+
+        Images are predicted chunk_size at a time and test metrics accumulated in self.metrics (see ImaMetrics), w/ the regularisation losses of the model added to the loss as in model.evaluate.
         """
-        self.values = np.zeros((3, gene.data.shape[0]), dtype='float32')
-        # if binary or regression
-        if len(gene.targets.shape) == 1:
-            probs = model.predict(gene.data, batch_size=None)[:,0]
-            self.values[1,:] = np.where(probs < 0.5, 0., 1.)
-            self.values[0,:] = gene.targets
-            self.values[2,:] = probs
-        else:
-            probs = model.predict(gene.data, batch_size=None)
-            self.values[1,:] = gene.classes[np.argmax(probs, axis=1)]
-            self.values[0,:] = gene.classes[np.argmax(gene.targets, axis=1)]
-            self.values[2,:] = [np.average(gene.classes, weights=probs[i]) for i in range(probs.shape[0])]
+        self.values = np.zeros((3, len(gene.data)), dtype='float32')
+        # binary targets are 0/1 whatever the original classes
+        self.metrics = ImaMetrics(gene.classes if len(gene.targets.shape) == 2 else np.array([0, 1]))
+        self.metrics.regularisation = float(sum(float(loss) for loss in model.losses))
+        for i in range(0, len(gene.data), chunk_size):
+            data = np.asarray(gene.data[i:i+chunk_size])
+            targets = gene.targets[i:i+chunk_size]
+            # if binary or regression
+            if len(gene.targets.shape) == 1:
+                probs = model.predict(data, batch_size=None, verbose=0)[:,0]
+                self.values[1,i:i+chunk_size] = np.where(probs < 0.5, 0., 1.)
+                self.values[0,i:i+chunk_size] = targets
+                self.values[2,i:i+chunk_size] = probs
+            else:
+                probs = model.predict(data, batch_size=None, verbose=0)
+                summary = posterior_summary(probs, gene.classes)
+                self.values[1,i:i+chunk_size] = summary['MAP']
+                self.values[0,i:i+chunk_size] = gene.classes[np.argmax(targets, axis=1)]
+                self.values[2,i:i+chunk_size] = summary['mean']
+            self.metrics.update(targets, probs)
 
         return 0
 
@@ -844,7 +2242,11 @@ class ImaNet:
         """
         Plot confusion matrix (on testing set)
         """
-        cm = confusion_matrix(self.values[0,:], self.values[1,:])
+        # counts accumulated by predict
+        if getattr(self, 'metrics', None) != None:
+            cm = self.metrics.confusion
+        else:
+            cm = confusion_matrix(self.values[0,:], self.values[1,:])
         accuracy = np.trace(cm) / float(np.sum(cm))
         cm = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
 
@@ -887,3 +2289,27 @@ class ImaNet:
 
 
 
+
+
+class ImaNetCheckpoint(keras.callbacks.Callback):
+    """
+    Keras callback recording the scores of each epoch into an ImaNet object and saving it to file, so that training history survives an interruption
+
+    Scores of epochs at or after the current one are dropped first, so an epoch that is re-run after resuming (e.g. w/ keras.callbacks.BackupAndRestore) is recorded once.
+
+    Keyword Arguments:
+        net (ImaNet) -- object in which scores are recorded
+        file (string) -- file in which net is saved after each epoch
+    """
+    def __init__(self, net, file):
+        super().__init__()
+        self.net = net
+        self.file = file
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        for key in self.net.scores.keys():
+            del self.net.scores[key][epoch:]
+            if key in logs:
+                self.net.scores[key].append(float(logs[key]))
+        self.net.save(self.file)
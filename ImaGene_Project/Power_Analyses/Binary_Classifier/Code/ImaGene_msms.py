@@ -0,0 +1,99 @@
+"""
+ImaGene_msms.py
+
+Readers of (gzipped) msms simulation files used by `ImaFile.read_simulations` in ImaGene.py.
+
+They are kept apart from ImaGene.py, and import only the standard library and numpy, so that the worker processes which read files in parallel (spawned, see `ImaFile.read_simulations`) do not load TensorFlow, Keras, scikit-image and matplotlib just to parse text.
+"""
+
+
+#-----
+# Imports
+#-----
+# Standard-Library Imports
+import gzip # module to work w/ gzip-compressed files
+from multiprocessing import shared_memory # memory blocks shared between processes
+
+# 3rd-Party Imports
+import numpy as np # library for numerical operations
+
+
+def stream_msms_replicates(f, nr_samples, max_nrepl=None):
+    """
+    Iterate over replicates of an open (gzipped) msms file, one replicate at a time
+
+    The file is decompressed incrementally and each block of haplotypes is decoded in a single numpy step, so peak memory is bounded by one replicate rather than by the whole file.
+
+    Keyword Arguments:
+        f (file object) -- msms file opened in binary mode, positioned after the first line
+        nr_samples (int) -- nr of haplotypes (rows) per replicate
+        max_nrepl (int) -- max nr of replicates to read (if set)
+
+    Return:
+        generator of (positions, haplotypes) with positions a float32 array and haplotypes a uint8 array of shape (nr_samples, segsites, 1)
+    """
+    nr_read = 0
+    for line in f:
+        # replicates start with the // char
+        if line.rstrip(b'\r\n') != b'//':
+            continue
+        if max_nrepl != None and nr_read >= max_nrepl:
+            break
+
+        nr_columns = int(f.readline().split(b'segsites: ')[1])
+        # msms writes neither positions nor haplotypes for replicates without segregating sites
+        if nr_columns == 0:
+            nr_read += 1
+            yield np.zeros(0, dtype='float32'), np.zeros((nr_samples, 0, 1), dtype='uint8')
+            continue
+        pos = f.readline().decode('utf8').split()[1:]
+        positions = np.asarray(pos, dtype='float32')
+        del pos
+
+        # raw bytes of all haplotypes, without line terminators
+        block = b''.join([f.readline().rstrip(b'\r\n') for j in range(nr_samples)])
+        block = np.frombuffer(block, dtype='uint8').reshape(nr_samples, nr_columns, 1)
+        # if not 0 --> 1, then switch colours so that 1s are black (255) and 0s are white
+        haplotypes = (block != ord('0')).astype('uint8')
+        haplotypes *= 255
+        del block
+
+        nr_read += 1
+        yield positions, haplotypes
+
+
+def read_msms_shared(full_name, nr_samples, max_nrepl=None):
+    """
+    Read one msms file and place all its haplotypes in a block of shared memory (used by parallel workers of ImaFile.read_simulations)
+
+    Keyword Arguments:
+        full_name (string) -- path to the gzipped msms file
+        nr_samples (int) -- nr of haplotypes (rows) per replicate
+        max_nrepl (int) -- max nr of replicates to read (if set)
+
+    Return:
+        first_line (string), name of the shared memory block (string), nr of columns of each replicate (list), positions (list)
+    """
+    with gzip.open(full_name, 'rb') as f:
+        first_line = f.readline().decode('utf8').rstrip('\r\n')
+        replicates = list(stream_msms_replicates(f, nr_samples, max_nrepl))
+
+    nr_columns = [haplotypes.shape[1] for pos, haplotypes in replicates]
+    size = nr_samples * sum(nr_columns)
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        buffer = np.ndarray((size,), dtype='uint8', buffer=block.buf)
+        offset = 0
+        for pos, haplotypes in replicates:
+            buffer[offset:offset + haplotypes.size] = haplotypes.ravel()
+            offset += haplotypes.size
+        del buffer
+    except BaseException:
+        # the caller never learns the name of the block, so remove it here
+        buffer = None
+        block.close()
+        block.unlink()
+        raise
+    block.close()
+
+    return first_line, block.name, nr_columns, [pos for pos, haplotypes in replicates]
@@ -69,6 +69,191 @@ from ImaGene import *
 # 'ImaGene' module.
 
 
+def process_batch(path_sim, i, n_workers=1):
+    """
+    Process 1 batch of synthetic data, which will be used to train a binary classifier.
+
+    Reads simulations of batch `i` (`{path_sim}/Simulations{i}`), filters, sorts, 
+    resizes, converts & shuffles images, converts targets to binary format, & 
+    saves processed batch as store `{path_sim}/gene_sim_Batch{i}`.
+
+    Parameters:
+    path_sim (str): directory path where output data of simulations are stored.
+    i (int): batch number.
+    n_workers (int): nr of processes reading msms files of batch in parallel 
+    (at most 1 per file; 1 reads them one after another).
+
+    Returns:
+    gene_sim: processed `ImaGene` object (as saved).
+    """
+    
+    #----
+    # Load batch of synthetic data.
+    #----
+    print(f'Processing batch: {path_sim}/Simulations{i}/')
+    # Output specified message to the console.
+    # Identifies param set, replicate nr, & batch nr of data currently being processed.
+    # f-string allows for dynamic insertion of var into string.
+    
+    file_sim = ImaFile(simulations_folder=os.path.join(path_sim, f'Simulations{i}'), 
+                       nr_samples=198, model_name='Marth-3epoch-CEU')
+    # Make `ImaFile` obj (initiate instance of `ImaFile` class) to access 
+    # specific batch of sims.
+    # `ImaFile` obj holds metadata & path to synthetic data (it doesn't 
+    # actually load synthetic data, but acts as interface to access/manage it).
+    # Use `os.path.join()` fn to construct path to specific batch of sims. 
+    # Combine `path_sim` var (dir containing all batches of sim data) w/ 
+    # dynamically generated dir name, `Simulations{i}`, where `i` is batch nr.
+    
+    # pdb.set_trace()
+    gene_sim = file_sim.read_simulations(parameter_name='selection_coeff_hetero', 
+                                         max_nrepl=2000, # *
+                                        #  max_nrepl=20000, X
+                                         n_workers=n_workers)
+    # Load synthetic data into `ImaGene` obj (call `read_simulations` method 
+    # of `ImaFile` instance).
+    # Specify var we want to estimate/predict (feature of interest in sims- 
+    # selection coefficient for heterozygotes, `selection_coeff_hetero`).
+    # Set upper limit on nr of data pts (replicates) to load per class 
+    # within sims. We may limit nr of data pts, eg to 2000 per class, as 
+    # quick test example. This is useful if dealing w/ big dataset, as it 
+    # keeps data handling efficient & manageable.
+    # W/ `n_workers > 1`, ea msms file (1 per SEL & TIME pair) is read by a 
+    # separate (spawned) process. Result is identical to reading files one 
+    # after another (`n_workers=1`, default).
+    # A batch has only 2 files, & ea spawned process re-imports the main 
+    # script (& so TensorFlow) before reading, so reading 1 file after another 
+    # is usually faster here & uses far less memory.
+    
+    gene_sim.summary()
+    # Print overview of data stored in obj, inc nr of images it contains & 
+    # stat info about dimensions of images (max, min, mean, & SD of rows & cols).
+    # `.summary()`- method of `ImaGene` class called on `gene_sim` obj
+    
+    # gene_sim.plot()
+    # `plot()` displays image from `ImaGene` obj, by default 1st image 
+    # (index=0) as grayscale plot.
+    
+    
+    #----
+    # Process synthetic data.
+    #----
+    gene_sim.filter_freq(0.01, statistics=True)
+    # gene_sim.summary()
+    # gene_sim.plot()
+    # W/ `statistics=True`, summary statistics (SFS, Tajima's D, Fay & Wu's H, 
+    # Garud's H12 around selected site) are calculated on all sites from same 
+    # allele counts & stored in `gene_sim.statistics`- baselines for the CNN, 
+    # saved w/ the batch.
+    # Remove genetic variants (SNPs) w/ minor allele frequency (MAF) <1% 
+    # -removes monomorphic sites, singletons, & other rare variants w/ MAFs <1%.
+    # This filtering is standard practice in genomic studies.
+    # It simplifies dataset by focusing on more common variants, which are 
+    # generally more informative & less likely to be noise or sequencing errors.
+    
+    
+    # gene_LCT.sort?
+    # `gene_LCT.sort?` or `?gene_LCT.sort`:In IPython terminal & Jupyter 
+    # notebooks, question mark before/after obj, fn, or method is used to 
+    # display docstring or documentation related to that object.
+    
+    gene_sim.sort('rows_freq')
+    # gene_sim.summary()
+    # gene_sim.plot()
+    # `.sort()` method of `ImaGene` class rearranges data within ea genomic 
+    # image based on specified criterion.
+    # It operates on ea image individually.
+    # Sorting structures data in meaningful way, potentially making it easier 
+    # for ML models to identify/learn genetic patterns.
+    
+    
+    # gene_sim.resize? # See different options for resizing.
+    gene_sim.resize((198, 192))
+    # gene_sim.summary()
+    # gene_sim.plot()
+    # Resize all images in `ImaGene` obj to uniform dimension.
+    # `ImaGene` tut, '01_binary.ipynb', resized all images to have shape 
+    # (198, 192) (198 rows, 192 cols) to match dims of real data used in analysis.
+    # In context of this power analysis w/o real data, we retain these dims 
+    # for simplicity & to maintain consistency.
+    # If deploying model on real genomic data, it's essential to adjust 
+    # `.resize()` dims for training data to match dims of real data.
+    # This ensures compatibility & accuracy in model's application to real datasets.
+    
+    # pdb.set_trace()
+    gene_sim.convert(flip=True)
+    # gene_sim.summary()
+    # gene_sim.plot()
+    # Use `.convert` method of `ImaGene` obj w/ `flip=True` keyword arg.
+    # Converts images to proper numpy float matrices- from `uint8` format 
+    # (integer vals from 0 to 255) to `float32` format (floating-point nrs).
+    # Additionally, `flip=True` keyword arg reverses pixel vals to assign 
+    # black to the alternate allele.
+    # This ensures data is in format suitable for ML alg & enhances clarity 
+    # of genetic patterns.
+    # Flipping aligns w standard representation of genomic data where minor 
+    # alleles are often marked distinctly for better interpretability.
+    
+    
+    gene_sim.subset(get_index_random(gene_sim), lazy=True)
+    # gene_sim.summary()
+    # gene_sim.plot()
+    # Randomise order of genomic images in `gene_sim` obj.
+    # This is crucial for training ML models, as it prevents model from 
+    # learning any order-specific biases & helps in generalising better to 
+    # new, unseen data.
+    # `gene_sim.subset(get_index_random(gene_sim))` randomly reorders 
+    # collection of genomic images in entire dataset, but doesn't alter data 
+    # within ea indiv image.
+    
+    # `gene_sim.subset(get_index_random(gene_sim))` 1st calls `get_index_random(gene_sim)` 
+    # on `ImaGene` obj to generate randomly ordered array of indices corresponding 
+    # to genomic images in `gene_sim`.
+    # `gene_sim.subset(...)` then rearranges images based on this random sequence.
+    # W/ `lazy=True` it only records the random order; images are gathered 
+    # in one go when `.save()` below needs them.
+    # `get_index_random` fn in `ImaGene.py` module
+    # `ImaGene.subset()` method (of `ImaGene` class)
+    
+    
+    gene_sim.targets = to_binary(gene_sim.targets)
+    # Convert target vals in `gene_sim` to binary format suitable for binary 
+    # classification in Keras.
+    # `targets` attribute of `ImaGene` class is array that holds target vals 
+    # (classes/labels) for ea genomic image in (`gene_sim`) dataset.
+    # `to_binary` fn in `ImaGene.py` module compares ea target val to min 
+    # val in `targets` array (`targets.min()`). Fn sets target val to 0 if 
+    # it equals min val; otherwise, it's set to 1.
+    # After transformation, `targets` is numpy array of `float32` data type 
+    # & contains only 0s & 1s- simplified binary classification problem, 
+    # where ea val indicates binary class of corresponding image.
+    # Conversion is necesscary to align w compatability requirements of 
+    # binary classification tasks in Keras.
+    
+    # gene_sim.save(file=f'{path_sim}/gene_sim.binary')
+    gene_sim.save(file=os.path.join(path_sim, 
+                                    # f'Simulations{i}', 
+                                    f'gene_sim_Batch{i}'), 
+                  format='store')
+    # `gene_sim` obj is now ready for model training.
+    # Use `.save()` method of `ImaGene` class to save it.
+    # Images are binary after `.resize()` w/ `set_to_boundaries=True`, so 
+    # w/ `format='store'` they are bit-packed into compressed chunks 
+    # (`ImaGeneStore`) in dir `gene_sim_Batch{i}`- ~32x smaller than float32.
+    # Other arrays (targets, ...) are saved as .npy files next to them.
+    # (`format='npy'` saves uncompressed arrays that can be memory-mapped.)
+    # Construct file path- use f-string to insert `path_sim` var directly 
+    # into str.
+    
+    # gene_sim = load_imagene(file=f'{path_sim}/gene_sim.binary')
+    # `load_imagene` fn in `ImaGene.py` module loads previously saved 
+    # `ImaGene` obj.
+    # It reads dirs saved w/ `format='store'` or `format='npy'` (memory-mapped) 
+    # & unpickles files otherwise.
+
+    return gene_sim
+
+
 def process_simulations_binary(path_sim):
     """
     Process batches of synthetic data, which will be used to train a binary classifier.
@@ -92,151 +277,10 @@ def process_simulations_binary(path_sim):
     # neural network with a 'simulation-on-the-fly' approach.
     # Loop over nrs 1 to 10 inclusive- iterate over ea batch.
         
-        
-        #----
-        # Load batch of synthetic data.
-        #----
-        print(f'Processing batch: {path_sim}/Simulations{i}/')
-        # Output specified message to the console.
-        # Identifies param set, replicate nr, & batch nr of data currently being processed.
-        # f-string allows for dynamic insertion of var into string.
-        
-        file_sim = ImaFile(simulations_folder=os.path.join(path_sim, f'Simulations{i}'), 
-                           nr_samples=198, model_name='Marth-3epoch-CEU')
-        # Make `ImaFile` obj (initiate instance of `ImaFile` class) to access 
-        # specific batch of sims.
-        # `ImaFile` obj holds metadata & path to synthetic data (it doesn't 
-        # actually load synthetic data, but acts as interface to access/manage it).
-        # Use `os.path.join()` fn to construct path to specific batch of sims. 
-        # Combine `path_sim` var (dir containing all batches of sim data) w/ 
-        # dynamically generated dir name, `Simulations{i}`, where `i` is batch nr.
-        
-        # pdb.set_trace()
-        gene_sim = file_sim.read_simulations(parameter_name='selection_coeff_hetero', 
-                                             max_nrepl=2000) # *
-                                            #  max_nrepl=20000) X
-        # Load synthetic data into `ImaGene` obj (call `read_simulations` method 
-        # of `ImaFile` instance).
-        # Specify var we want to estimate/predict (feature of interest in sims- 
-        # selection coefficient for heterozygotes, `selection_coeff_hetero`).
-        # Set upper limit on nr of data pts (replicates) to load per class 
-        # within sims. We may limit nr of data pts, eg to 2000 per class, as 
-        # quick test example. This is useful if dealing w/ big dataset, as it 
-        # keeps data handling efficient & manageable.
-        
-        gene_sim.summary()
-        # Print overview of data stored in obj, inc nr of images it contains & 
-        # stat info about dimensions of images (max, min, mean, & SD of rows & cols).
-        # `.summary()`- method of `ImaGene` class called on `gene_sim` obj
-        
-        # gene_sim.plot()
-        # `plot()` displays image from `ImaGene` obj, by default 1st image 
-        # (index=0) as grayscale plot.
-        
-        
-        #----
-        # Process synthetic data.
-        #----
-        gene_sim.filter_freq(0.01)
-        # gene_sim.summary()
-        # gene_sim.plot()
-        # Remove genetic variants (SNPs) w/ minor allele frequency (MAF) <1% 
-        # -removes monomorphic sites, singletons, & other rare variants w/ MAFs <1%.
-        # This filtering is standard practice in genomic studies.
-        # It simplifies dataset by focusing on more common variants, which are 
-        # generally more informative & less likely to be noise or sequencing errors.
-        
-        
-        # gene_LCT.sort?
-        # `gene_LCT.sort?` or `?gene_LCT.sort`:In IPython terminal & Jupyter 
-        # notebooks, question mark before/after obj, fn, or method is used to 
-        # display docstring or documentation related to that object.
-        
-        gene_sim.sort('rows_freq')
-        # gene_sim.summary()
-        # gene_sim.plot()
-        # `.sort()` method of `ImaGene` class rearranges data within ea genomic 
-        # image based on specified criterion.
-        # It operates on ea image individually.
-        # Sorting structures data in meaningful way, potentially making it easier 
-        # for ML models to identify/learn genetic patterns.
-        
-        
-        # gene_sim.resize? # See different options for resizing.
-        gene_sim.resize((198, 192))
-        # gene_sim.summary()
-        # gene_sim.plot()
-        # Resize all images in `ImaGene` obj to uniform dimension.
-        # `ImaGene` tut, '01_binary.ipynb', resized all images to have shape 
-        # (198, 192) (198 rows, 192 cols) to match dims of real data used in analysis.
-        # In context of this power analysis w/o real data, we retain these dims 
-        # for simplicity & to maintain consistency.
-        # If deploying model on real genomic data, it's essential to adjust 
-        # `.resize()` dims for training data to match dims of real data.
-        # This ensures compatibility & accuracy in model's application to real datasets.
-        
-        # pdb.set_trace()
-        gene_sim.convert(flip=True)
-        # gene_sim.summary()
-        # gene_sim.plot()
-        # Use `.convert` method of `ImaGene` obj w/ `flip=True` keyword arg.
-        # Converts images to proper numpy float matrices- from `uint8` format 
-        # (integer vals from 0 to 255) to `float32` format (floating-point nrs).
-        # Additionally, `flip=True` keyword arg reverses pixel vals to assign 
-        # black to the alternate allele.
-        # This ensures data is in format suitable for ML alg & enhances clarity 
-        # of genetic patterns.
-        # Flipping aligns w standard representation of genomic data where minor 
-        # alleles are often marked distinctly for better interpretability.
-        
-        
-        gene_sim.subset(get_index_random(gene_sim))
-        # gene_sim.summary()
-        # gene_sim.plot()
-        # Randomise order of genomic images in `gene_sim` obj.
-        # This is crucial for training ML models, as it prevents model from 
-        # learning any order-specific biases & helps in generalising better to 
-        # new, unseen data.
-        # `gene_sim.subset(get_index_random(gene_sim))` randomly reorders 
-        # collection of genomic images in entire dataset, but doesn't alter data 
-        # within ea indiv image.
-        
-        # `gene_sim.subset(get_index_random(gene_sim))` 1st calls `get_index_random(gene_sim)` 
-        # on `ImaGene` obj to generate randomly ordered array of indices corresponding 
-        # to genomic images in `gene_sim`.
-        # `gene_sim.subset(...)` then rearranges images based on this random sequence.
-        # `get_index_random` fn in `ImaGene.py` module
-        # `ImaGene.subset()` method (of `ImaGene` class)
-        
-        
-        gene_sim.targets = to_binary(gene_sim.targets)
-        # Convert target vals in `gene_sim` to binary format suitable for binary 
-        # classification in Keras.
-        # `targets` attribute of `ImaGene` class is array that holds target vals 
-        # (classes/labels) for ea genomic image in (`gene_sim`) dataset.
-        # `to_binary` fn in `ImaGene.py` module compares ea target val to min 
-        # val in `targets` array (`targets.min()`). Fn sets target val to 0 if 
-        # it equals min val; otherwise, it's set to 1.
-        # After transformation, `targets` is numpy array of `float32` data type 
-        # & contains only 0s & 1s- simplified binary classification problem, 
-        # where ea val indicates binary class of corresponding image.
-        # Conversion is necesscary to align w compatability requirements of 
-        # binary classification tasks in Keras.
-        
-        # gene_sim.save(file=f'{path_sim}/gene_sim.binary')
-        gene_sim.save(file=os.path.join(path_sim, 
-                                        # f'Simulations{i}', 
-                                        f'gene_sim_Batch{i}.binary'))
-        # `gene_sim` obj is now ready for model training.
-        # Use `.save()` method of `ImaGene` class to save it.
-        # The method uses `pickle` module to serialise obj & save it in binary format.
-        # Construct file path- use f-string to insert `path_sim` var directly 
-        # into str.
-        
-        # gene_sim = load_imagene(file=f'{path_sim}/gene_sim.binary')
-        # `load_imagene` fn in `ImaGene.py` module loads previously saved 
-        # `ImaGene` obj.
-        # It uses `pickle` module for deserialisation.
+        process_batch(path_sim, i)
+        # Process & save batch `i` (see `process_batch` fn above).
+        # `Train_On_The_Fly.py` calls `process_batch` on ea batch as soon as it 
+        # is simulated, instead of waiting for all 10 batches.
 
 
 def main(analysis_version, run_nr):
@@ -72,13 +72,19 @@ import time
 # capture precise time pts before & after code execution.
 
 
-def run_simulations(param_file_path, output_dir):
+def run_simulations(param_file_path, output_dir, batch=None):
     """
     Runs a set of simulations using the given parameter file. Saves the 
     simulation data in the specified output directory.
+
+    If `batch` (int) is given, only simulations of that batch are run (used to 
+    simulate batches one at a time for 'simulation-on-the-fly' training).
     """
     
     cmd = ['bash', 'generate_dataset.sh', param_file_path, output_dir]
+    if batch is not None:
+        cmd.append(str(batch))
+    # Optional 3rd arg of shell script- nr of single batch to simulate.
     subprocess.call(cmd)
     # Execute shell cmd from within Python- run 'generate_dataset.sh' shell script.
     # When you use `subprocess.call()`, you must pass cmd & args as list- ea 
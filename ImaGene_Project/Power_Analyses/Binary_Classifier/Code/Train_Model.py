@@ -3,7 +3,10 @@
 """
 Uses a synthetic genetic dataset to train & test a binary classifier model.
 
-When run as a standalone program, this script trains multiple ML models sequentially, one after the other - trains a new ML model on each unique set of training data.
+When run as a standalone program, this script trains multiple ML models - a new 
+ML model on each unique set of training data. Runs are trained concurrently in a 
+pool of worker processes (see `train_runs`), ea w/ its own share of the node's 
+cores.
 
 The `main` function:
 - Takes as input a run number - a unique, sequential identifier for each 
@@ -66,6 +69,10 @@ import time
 # It's essential for measuring performance / execution time, as it allows us to 
 # capture precise time pts before & after code execution.
 
+import multiprocessing
+import concurrent.futures
+# modules to train several runs' models concurrently in a pool of processes
+
 # Local-Application Imports
 from ImaGene import *
 # W/ ImaGene.py in same directory as this script, import everything from 
@@ -102,10 +109,37 @@ import pydot
 # - plot model's predictions again true labels (confusion matrix, scatter plot).
 
 
-def build_model(gene_sim, path_results):
+def bfloat16_supported():
+    """
+    Checks whether the CPU has native bfloat16 instructions (AVX512-BF16 or 
+    AMX-BF16 on x86, BF16 on ARM), read from '/proc/cpuinfo'.
+
+    W/o them, bfloat16 is emulated & mixed precision is slower than float32.
+
+    Returns:
+    - True if bfloat16 is supported, False otherwise (incl if CPU flags can't 
+    be read, eg on macOS)
+    """
+
+    try:
+        with open('/proc/cpuinfo', 'r') as file:
+            flags = set(file.read().split())
+    except OSError:
+        return False
+    return bool(flags & {'avx512_bf16', 'amx_bf16', 'bf16'})
+
+
+def build_model(gene_sim, path_results, fast=False):
     """
     Builds & compiles a Keras model. Dynamically sets the input shape of the 
     model's first layer based on dimensions of a batch of training data.
+
+    W/ `fast=True`, the model is compiled w/ XLA (`jit_compile=True`) & uses 
+    bfloat16 mixed precision if the CPU supports it (see `bfloat16_supported`). 
+    Weights & the output layer stay float32. Validate a model trained this way 
+    w/ `validate_fast_model`. oneDNN kernels must be enabled before TensorFlow 
+    is imported: `train_runs(..., fast=True)` does so in its workers; for a 
+    single run, export `TF_ENABLE_ONEDNN_OPTS=1` in the job script.
     
     Users can manually adjust the model architecture/configuration as needed. 
     Generates a graphical visualisation of the model's architecture & saves it 
@@ -116,6 +150,7 @@ def build_model(gene_sim, path_results):
     training data
     - path_results (str): path to the directory in which to save a graphical 
     visualisation of the model's architecture.
+    - fast (bool): whether to use XLA & mixed precision (default: False)
 
     The function:
     - expects the `gene_sim.data` attribute to be a NumPy array.
@@ -129,7 +164,20 @@ def build_model(gene_sim, path_results):
     #----
     # Build & compile Keras Sequential model.
     #----
-    model = models.Sequential([
+    policy = keras.mixed_precision.global_policy()
+    if fast and bfloat16_supported():
+        keras.mixed_precision.set_global_policy('mixed_bfloat16')
+    # Layers made below compute in bfloat16 (variables stay float32).
+    # Layers take policy when made, so global policy is restored right after.
+
+    scaling = []
+    if gene_sim.data.dtype == 'uint8':
+        scaling = [layers.Rescaling(1./255, input_shape=gene_sim.data.shape[1:])]
+    # Batches converted w/ `gene_sim.convert(dtype='uint8')` store 0-255 
+    # integers (4x smaller than float32). Scale them to [0,1] in the model's 
+    # first layer instead.
+
+    model = models.Sequential(scaling + [
     # Make obj (instance) of Keras Sequential model class (linear stack of layers).
 
         layers.Conv2D(filters=32, kernel_size=(3,3), strides=(1,1), 
@@ -140,7 +188,8 @@ def build_model(gene_sim, path_results):
                     #   input_shape=(198, 192, 1)),
         # Add 2D convolutional layer, configured w/ 32 filters, 3x3 kernel size, 
         # stride of 1, ReLU activation fn, Elastic Net regularisation, 'valid' padding.
-        # Input shape dynamically matches dims of training data.
+        # Input shape dynamically matches dims of training data (ignored if 
+        # a rescaling layer comes first).
         # 'valid' padding means no padding- convolution operation is only 
         # applied to regions where filter fully fits inside input volume.
         # Dims of output volume may reduce.
@@ -179,22 +228,27 @@ def build_model(gene_sim, path_results):
         # Add dense (fully connected) layer to network.
         # Use 128 units w/ ReLU activation fn.
 
-        layers.Dense(units=1, activation='sigmoid')
+        layers.Dense(units=1, activation='sigmoid', dtype='float32')
         # Another dense layer, but w/ single unit & sigmoid activation fn.
+        # Always float32, so output probabilities are float32 under mixed 
+        # precision too.
         # This is typical configuration for binary classification, where output 
         # is probability of input belonging to 1 of 2 classes.
         # Sigmoid fn outputs val b/w 0 & 1.
     ])
+    keras.mixed_precision.set_global_policy(policy)
 
     # pdb.set_trace()
     model.compile(optimizer='rmsprop', loss='binary_crossentropy', 
-                  metrics=['accuracy'])
+                  metrics=['accuracy'], **({'jit_compile': True} if fast else {}))
     # Compile model & specify settings- optimisation algorithm to use, loss fn 
     # to be minimise during training, & performance metrics to evaluate during 
     # training & testing.
     # Binary crossentropy is used for binary classification tasks & measures 
     # performance of model whose output is probability val b/w 0 & 1.
     # Accuracy measures fraction of correctly classified instances.
+    # W/ `fast=True`, training & prediction steps are compiled w/ XLA, which 
+    # fuses ops into fewer, larger kernels.
 
     model_tracker = ImaNet(name='[C32+P]x2+[C64+P]+D128')
     # Instantiate `ImaNet` obj.
@@ -211,20 +265,84 @@ def build_model(gene_sim, path_results):
     return model, model_tracker
 
 
-def train_model(path_training_data, path_results):
+def validate_fast_model(path_training_data, path_results, metrics, gene_sim, 
+                        tolerance=0.01, seed=0, warm_start=None):
+    """
+    Validates a model trained w/ `build_model(..., fast=True)` against a 
+    float32 baseline on held-out data.
+
+    The baseline is a model built w/ `fast=False` & trained on the same data 
+    w/ the same seed (see `train_model`), so the comparison includes any 
+    accuracy lost to bfloat16 training or XLA compilation, not only to 
+    reduced precision at prediction. Baseline training results are saved in 
+    `{path_results}/float32_baseline`.
+
+    Parameters:
+    - path_training_data (str): path to directory containing batches of training data
+    - path_results (str): path to directory of results of fast model
+    - metrics: `ImaMetrics` object of fast model on held-out data 
+    (`model_tracker.metrics` after `evaluate_model`)
+    - gene_sim: `ImaGene` object w/ held-out images & binary targets (eg test batch)
+    - tolerance (float): max allowed difference in accuracy
+    - seed (int): seed the fast model was trained w/
+    - warm_start (str): trained model the fast model was initialised from
+
+    Returns:
+    - validation (dict): test accuracy & loss of fast model & of baseline, & 
+    whether difference in accuracy is within `tolerance`
+    """
+
+    path_baseline = os.path.join(path_results, 'float32_baseline')
+    os.makedirs(path_baseline, exist_ok=True)
+    baseline, baseline_tracker = train_model(path_training_data, path_baseline, 
+                                             fast=False, seed=seed, 
+                                             warm_start=warm_start)
+    # Train float32 baseline as fast model was trained.
+
+    baseline_tracker.predict(gene_sim, baseline)
+    # Test metrics of baseline on same held-out data.
+
+    validation = {'Accuracy': float(metrics.accuracy), 
+                  'Baseline_Accuracy': float(baseline_tracker.metrics.accuracy), 
+                  'Loss': float(metrics.loss), 
+                  'Baseline_Loss': float(baseline_tracker.metrics.loss)}
+    validation['Within_Tolerance'] = abs(validation['Accuracy'] - validation['Baseline_Accuracy']) <= tolerance
+    print(f'Fast path validation: {validation}')
+
+    return validation
+
+
+def train_model(path_training_data, path_results, fast=False, patience=3, 
+                warm_start=None, seed=None):
     """
-    Iteratively trains an artificial neural network model on training data 
-    loaded in batches.
+    Trains an artificial neural network model on training data saved in 
+    batches.
     
-    Iterates over the first 9 batches of synthetic genetic data, training the 
-    model on each. The function expects batches of training data to be saved in 
-    a directory structure of the format `{path_training_data}/Simulations{i}/` 
-    (where `i` is batch number).
+    Streams the first 9 batches of synthetic genetic data through a `tf.data` 
+    input pipeline & trains the model on them in a single `fit` (1 epoch per 
+    batch's worth of images). The function expects batches of training data to 
+    be saved as stores in `{path_training_data}/gene_sim_Batch{i}` (where `i` 
+    is batch number).
+
+    Training is checkpointed after ea epoch (model & optimiser state in 
+    `{path_results}/backup`, `ImaNet` scores in 
+    `{path_results}/model_tracker.checkpoint`) & resumes from last completed 
+    epoch if the function is called again after an interruption (eg a 
+    pre-empted job). Checkpoints are deleted once training completes.
 
     Parameters:
     - path_training_data (str): path to directory containing batches of training data
     - path_results (str): path to the directory in which to save training 
     results (plot of training & validation loss & accuracy over epochs).
+    - fast (bool): whether to build model w/ XLA & mixed precision (see 
+    `build_model`)
+    - patience (int): nr of epochs w/o improvement in validation loss after 
+    which training stops (best weights are restored). `None` trains all epochs.
+    - warm_start (str): path to a trained model file (eg 'model.binary.h5' of a 
+    neighbouring param set) whose weights initialise the model. Ignored when 
+    resuming from a checkpoint.
+    - seed (int): seed of weight initialisation, for reproducible training 
+    (eg to compare w/ `validate_fast_model`). Not set by default.
 
     Returns:
     - model: trained neural network model
@@ -234,77 +352,112 @@ def train_model(path_training_data, path_results):
 
     # pdb.set_trace() # debugger entry point
 
-    for i in range(1, 10):
+    stores = [ImaGeneStore(os.path.join(path_training_data, 
+                                        # f'Simulations{i}', 
+                                        f'gene_sim_Batch{i}')) 
+              for i in range(1, 10)]
     # We split ea set of (synthetic) training data into batches, so we can train 
     # a neural network with a 'simulation on-the-fly' approach.
-    # Loop over nrs 1 to 9- iterate over batches.
-    # Train on 1st 9 batches.
+    # Open 1st 9 batches- train on them.
     # Reserve 10th batch for testing model's performance after training.
-        
+    # `process_simulations` fn in 'Process_Synthetic_Data' Python script 
+    # called, for ea data batch, `.save()` method of `ImaGene` class to save it 
+    # w/ `format='store'`.
+    # `ImaGeneStore` obj only reads index of compressed chunks- images are 
+    # decompressed on demand by input pipeline below.
+    print(f'Training on batches: {path_training_data}/gene_sim_Batch1-9')
+    
 
-        #----
-        # Load batch of synthetic data.
-        #----
-        print(f'Training on batch: {path_training_data}/Simulations{i}/')
-        # Output specified message to the console.
-        # Identifies param set, replicate nr, & batch nr of data currently being used.
-        # f-string allows for dynamic insertion of var into string.
-        
-        batch_path = os.path.join(path_training_data, 
-                                #   f'Simulations{i}', 
-                                  f'gene_sim_Batch{i}.binary')
-        # Construct path to batch of (processed, synthetic) data.
-
-        with open(batch_path, 'rb') as file:
-            gene_sim = pickle.load(file)
-        # Deserialise data- `ImaGene` obj.
-        # `process_simulations` fn in 'Process_Synthetic_Data' Python script 
-        # called, for ea data batch, `.save()` method of `ImaGene` class to save it.
-        # The method uses `pickle` module to serialise `ImaGene` (`gene_sim`) 
-        # obj & save it in binary format.
-        
+    #----
+    # Build input pipeline over all training batches.
+    #----
+    threads = tf.config.threading.get_intra_op_parallelism_threads() or None
+    # Nr of threads pinned for this process (see `init_worker`), or `None` 
+    # (all cores) if not pinned.
+
+    training_data, validation_data, steps = make_datasets(stores, batch_size=64, 
+                                                          validation_fraction=0.10, 
+                                                          seed=0, threads=threads)
+    # `make_datasets` fn in `ImaGene.py` module builds `tf.data` pipelines:
+    # - ea batch is split into training (90%) & validation (10%) images w/ same 
+    # class proportions
+    # - chunks of images are read interleaved across batches & decompressed in 
+    # parallel
+    # - training images are shuffled within a bounded buffer, grouped into 
+    # mini-batches of 64, & prefetched
+    # Disk reads & decoding overlap w/ training steps.
+    # Pipelines use at most `threads` threads, so concurrent runs (see 
+    # `train_runs`) don't oversubscribe cores.
+    # `steps`- nr of mini-batches in 1 (average) data batch.
+    
 
-        if i==1:
-            model, model_tracker = build_model(gene_sim, path_results)
-        # At 1st iteration, build & compile model.
-        
+    if seed is not None:
+        keras.utils.set_random_seed(seed)
+    # Seed Python, NumPy & TensorFlow random generators before model is built.
+
+    model, model_tracker = build_model(stores[0].to_imagene([0]), path_results, 
+                                       fast=fast)
+    # Build & compile model.
+    # Input shape & data type are taken from 1st image of 1st batch.
+
+    if warm_start is not None:
+        model.load_weights(warm_start)
+        print(f'Warm start from: {warm_start}')
+    # Initialise model w/ trained weights of another run (same architecture), 
+    # so it starts close to a good solution & stops early sooner.
+
+    path_checkpoint = os.path.join(path_results, 'model_tracker.checkpoint')
+    if os.path.exists(path_checkpoint):
+        model_tracker = load_imanet(path_checkpoint)
+    # Resume `ImaNet` scores of epochs completed before an interruption.
 
-        #----
-        # Initiate model training on 1 data batch.
-        #----
-        score = model.fit(gene_sim.data, gene_sim.targets, batch_size=64, 
-                          epochs=1, validation_split=0.10, verbose=1)
-        # Initiate training for model on 1 data batch.
-        # `model` is instance of Keras Sequential model class (linear stack of layers).
-        # `.fit` method trains model for specified nr of epochs (iterations over 
-        # the data).
-        # Adjusts model's weights to minimise loss fn.
-
-        # Within ea epoch, entire dataset is divided into subsets ("mini-batches").
-        # Splitting is sequential by default, taking 1st 64 samples, then next 
-        # 64, & so on, until it has processed all samples.
-        # Model updates occur after ea subset has been processed.
-        # Epoch is completed when model has been exposed to every sample in 
-        # dataset once.
-
-        # After ea epoch, model uses portion of data specified by 
-        # `validation_split` (10% here) to evaluate its performance.
-        
 
-        model_tracker.update_scores(score)
-        # Record training & validation metrics (eg, loss & accuracy) obtained 
-        # from current training session into `model_tracker`.
-
-        # `model_tracker` is instance of `ImaNet` class, which is designed to 
-        # track & store these metrics over time.
-        # `score` obj is result returned by `model.fit()` method during training 
-        # of Keras model.
-        # It contains history of training & validation metrics for ea epoch, eg 
-        # loss & accuracy.
-        # `update_scores` method of `ImaNet` class updates `model_tracker` obj 
-        # w/ training & validation metrics from current training batch.
+    #----
+    # Set up training controller.
+    #----
+    callbacks = [ImaNetCheckpoint(model_tracker, path_checkpoint), 
+                 keras.callbacks.BackupAndRestore(os.path.join(path_results, 'backup'))]
+    # After ea epoch, save `ImaNet` scores (`ImaNetCheckpoint` class in 
+    # `ImaGene.py` module), then model weights, optimiser state & epoch nr.
+    # On restart, `BackupAndRestore` restores model & skips completed epochs; 
+    # it deletes backup at end of training.
+    if patience is not None:
+        callbacks.append(keras.callbacks.EarlyStopping(monitor='val_loss', 
+                                                       patience=patience, 
+                                                       restore_best_weights=True))
+    # Stop when validation loss hasn't improved for `patience` epochs & keep 
+    # weights of best epoch.
+    
+
+    #----
+    # Initiate model training on all data batches.
+    #----
+    model.fit(training_data, epochs=len(stores), steps_per_epoch=steps, 
+              validation_data=validation_data, callbacks=callbacks, verbose=1)
+    # Initiate training for model in single `.fit()` call.
+    # `model` is instance of Keras Sequential model class (linear stack of layers).
+    # `.fit` method trains model for specified nr of epochs (iterations over 
+    # the data).
+    # Adjusts model's weights to minimise loss fn.
+
+    # Training pipeline repeats indefinitely, so `steps_per_epoch` defines an 
+    # epoch as `steps` mini-batches- as many images as 1 data batch.
+    # W/ 9 epochs, model sees as many images as before (9 batches x 1 epoch), 
+    # but mixed across batches.
+    # Model updates occur after ea mini-batch has been processed.
+
+    # After ea epoch, model uses `validation_data` (stratified 10% of ea batch) 
+    # to evaluate its performance.
     
 
+    os.remove(path_checkpoint)
+    # Training & validation metrics (eg, loss & accuracy) of ea epoch were 
+    # recorded into `model_tracker` by `ImaNetCheckpoint` callback (1 val per 
+    # epoch, incl epochs run before a restart).
+    # Training completed, so checkpoint of scores isn't needed anymore 
+    # (`model_tracker` is saved by `main`).
+
+
     # pdb.set_trace()
 
     model_tracker.plot_train(os.path.join(path_results, 'training_plot.png'))
@@ -314,6 +467,43 @@ def train_model(path_training_data, path_results):
     return model, model_tracker
 
 
+def train_on_batch(gene_sim, model, model_tracker, seed=None):
+    """
+    Trains the model for 1 epoch on 1 batch of (processed, synthetic) data 
+    already in memory, holding out a stratified 10% of it for validation.
+
+    Used for 'simulation-on-the-fly' training (see 'Train_On_The_Fly.py'), 
+    where ea batch is trained on as soon as it is simulated & processed.
+
+    Parameters:
+    - gene_sim: `ImaGene` object w/ images (`gene_sim.data`) & binary targets
+    - model (keras.Model): compiled model (see `build_model`)
+    - model_tracker: `ImaNet` object tracking training & validation metrics
+    - seed (int): seed of the training/validation split
+
+    Returns:
+    - model_tracker: `ImaNet` object updated w/ metrics of this epoch
+    """
+
+    train_index, validation_index = ImaSampler(gene_sim.targets, seed=seed).split((0.90, 0.10))
+    # Split batch into training (90%) & validation (10%) images w/ same class 
+    # proportions, in random order.
+    # `ImaSampler` class in `ImaGene.py` module only draws index arrays, data 
+    # is gathered once below.
+
+    score = model.fit(gene_sim.data[train_index], gene_sim.targets[train_index], 
+                      batch_size=64, epochs=1, 
+                      validation_data=(gene_sim.data[validation_index], 
+                                       gene_sim.targets[validation_index]), 
+                      verbose=1)
+    # Train model for 1 epoch on training images of batch.
+
+    model_tracker.update_scores(score)
+    # Record training & validation metrics of this epoch into `model_tracker`.
+
+    return model_tracker
+
+
 def evaluate_model(path_test_data, model, model_tracker, path_results):
     """
     Evaluates the trained model on unseen, test data.
@@ -333,23 +523,24 @@ def evaluate_model(path_test_data, model, model_tracker, path_results):
     
     # pdb.set_trace()
 
-    with open(path_test_data, 'rb') as file:
-        gene_sim_test = pickle.load(file)
-    # Deserialise data- `ImaGene` obj.
+    gene_sim_test = load_imagene(path_test_data)
+    # Load data- `ImaGene` obj (saved w/ `format='store'`).
         
-    test_loss, test_accuracy = model.evaluate(gene_sim_test.data, 
-                                              gene_sim_test.targets, verbose=2)
-    # Evaluate model's performance on test dataset.
-    # Assign resulting loss & accuracy metrics to `test_loss` & `test_accuracy` respectively.
-
-    print(f'Test Accuracy: {test_accuracy}, Test Loss: {test_loss}')
-    # Output model's test accuracy & loss to console after evaluation.
-    # Use f-string to dynamically insert vars into str.
-
     model_tracker.predict(gene_sim_test, model)
     # Use trained model to predict outcomes on test dataset (`gene_sim_test`).
     # Store predictions within `model_tracker` obj for further analysis.
     # `.predict` is method of `ImaNet` class.
+    # It predicts test set in chunks & accumulates test metrics (confusion 
+    # counts, loss, calibration, ROC/PR histograms) in `model_tracker.metrics`, 
+    # an `ImaMetrics` obj- no separate `model.evaluate()` pass needed.
+
+    test_loss, test_accuracy = model_tracker.metrics.loss, model_tracker.metrics.accuracy
+    # Model's performance on test dataset.
+    # Loss includes regularisation losses of model, as in `model.evaluate()`.
+
+    print(f'Test Accuracy: {test_accuracy}, Test Loss: {test_loss}')
+    # Output model's test accuracy & loss to console after evaluation.
+    # Use f-string to dynamically insert vars into str.
 
     model_tracker.plot_cm(gene_sim_test.classes, file=os.path.join(path_results, 'confusion_matrix.png'), text=True)
     # Generate confusion matrix plot, used to evaluate performance of 
@@ -360,20 +551,19 @@ def evaluate_model(path_test_data, model, model_tracker, path_results):
     return test_loss, test_accuracy, model, model_tracker
 
 
-def save_metrics_to_csv(path_results, test_loss, test_accuracy):
+def save_metrics_to_csv(path_results, metrics):
     """
-    Saves test set metrics (loss & accuracy) to a CSV file.
+    Saves test set metrics (loss, accuracy & ROC AUC) to a CSV file.
 
     Parameters:
     - path_results (str): directory in which to save CSV file
-    - test_loss (float): loss metric from test set evaluation
-    - test_accuracy (float): accuracy metric from test set evaluation.
+    - metrics: `ImaMetrics` object accumulated on test set (`model_tracker.metrics`)
     """
 
     metrics_file_path = os.path.join(path_results, f'test_metrics.csv')
     # Construct path to CSV file.
     
-    headers = ['Test_Loss', 'Test_Accuracy']
+    headers = ['Test_Loss', 'Test_Accuracy', 'Test_AUC']
     # Define list to hold col headers (header row) for CSV.
     
     with open(metrics_file_path, 'w', newline='') as csvfile:
@@ -400,12 +590,13 @@ def save_metrics_to_csv(path_results, test_loss, test_accuracy):
 
         writer.writeheader() # Write col names to CSV file.
         
-        writer.writerow({'Test_Loss': test_loss, 'Test_Accuracy': test_accuracy})
-        # Write row w/ test metrics to file (write `test_loss` & 
-        # `test_accuracy` in corresponding cols).
+        writer.writerow({'Test_Loss': metrics.loss, 'Test_Accuracy': metrics.accuracy, 
+                         'Test_AUC': metrics.roc_curve()[2]})
+        # Write row w/ test metrics to file (read from accumulated counts of 
+        # `metrics` & write them in corresponding cols).
 
 
-def main(analysis_version, run_nr):
+def main(analysis_version, run_nr, fast=False, warm_start=None, validate=False):
     """
     Orchestrates execution of the script's primary task.
     
@@ -413,6 +604,13 @@ def main(analysis_version, run_nr):
     - analysis_version (str): version number of the analysis, used to construct 
     dir paths
     - run_nr (int): unique, sequential identifier for each experimental run (job).
+    - fast (bool): whether to train w/ XLA & mixed precision (see `build_model`)
+    - warm_start (str): path to trained model of a neighbouring param set whose 
+    weights initialise the model (see `train_model`)
+    - validate (bool): w/ `fast=True`, also train a float32 baseline & compare 
+    both on test data (see `validate_fast_model`). Doubles training time of 
+    the run, so meant as a one-off check (eg on 1 run of the grid), not for 
+    every run.
     """
     
     config_file_path = os.path.join(analysis_version, 'Config_Files', 
@@ -439,21 +637,41 @@ def main(analysis_version, run_nr):
 
 
     # pdb.set_trace()
-    model, model_tracker = train_model(path_training_data, path_results)
+    model, model_tracker = train_model(path_training_data, path_results, fast=fast, 
+                                       warm_start=warm_start, 
+                                       seed=0 if fast and validate else None)
     # Call fn to train model on training data in batches.
+    # Resumes from checkpoints in `path_results` if an earlier job was 
+    # interrupted, & stops early once validation loss plateaus.
+    # When validating, fast model is seeded, so float32 baseline can be trained 
+    # the same way (see `validate_fast_model` below).
 
     # pdb.set_trace()
     path_test_data = os.path.join(path_training_data, 
                                 #   f'Simulations{10}', 
-                                  f'gene_sim_Batch{10}.binary')
+                                  f'gene_sim_Batch{10}')
     # Construct path to test dataset- 10th/last batch of sims.
 
     test_loss, test_accuracy, model, model_tracker = evaluate_model(path_test_data, model, 
                                                                     model_tracker, path_results)
     # Evaluate trained model on unseen, test data.
 
-    save_metrics_to_csv(path_results, test_loss, test_accuracy)
-    # Save test set metrics (loss & accuracy) to a CSV file.
+    save_metrics_to_csv(path_results, model_tracker.metrics)
+    # Save test set metrics (loss, accuracy & AUC) to a CSV file.
+
+    if fast and validate:
+        validation = validate_fast_model(path_training_data, path_results, 
+                                         model_tracker.metrics, 
+                                         load_imagene(path_test_data), seed=0, 
+                                         warm_start=warm_start)
+        with open(os.path.join(path_results, 'fast_path_validation.csv'), 'w', 
+                  newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=list(validation))
+            writer.writeheader()
+            writer.writerow(validation)
+    # Only if asked (one-off check): train float32 baseline on same data & 
+    # seed, compare its test accuracy & loss w/ those of fast (XLA/bfloat16) 
+    # model & save comparison to CSV file.
 
     model.save(os.path.join(path_results, 'model.binary.h5'))
     # Save trained Keras model to disk.
@@ -471,6 +689,119 @@ def main(analysis_version, run_nr):
     # Deserialise & load `ImaNet` obj from binary file.
 
 
+def init_worker(intra_op_threads, inter_op_threads):
+    """
+    Initialises a worker process of the pool in `train_runs`: pins nr of 
+    threads TensorFlow uses, so concurrent models don't oversubscribe cores.
+
+    Must run before TensorFlow runtime is initialised in the process (ie 
+    before 1st op), which is why it's passed as pool `initializer`.
+    The `tf.data` pipelines of the worker read the same budget (see 
+    `train_model`). OpenMP threads are limited by `OMP_NUM_THREADS`, which 
+    `train_runs` exports before workers are spawned- TensorFlow is already 
+    imported when this fn runs (it's unpickled w/ this module).
+
+    Parameters:
+    - intra_op_threads (int): nr of threads used within an op (eg a convolution)
+    - inter_op_threads (int): nr of ops run in parallel
+    """
+
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def run_worker(analysis_version, run_nr, fast=False):
+    """
+    Trains, evaluates & saves model of 1 run in a worker process (see `main`).
+
+    Returns:
+    - run_nr (int): run nr
+    - execution time of run (s)
+    """
+
+    run_start_time = time.time()
+    main(analysis_version, run_nr, fast=fast)
+    keras.backend.clear_session()
+    # Free model & graph of this run before worker moves on to next run- 
+    # TensorFlow runtime itself stays loaded & is reused.
+    return run_nr, time.time() - run_start_time
+
+
+def train_runs(analysis_version, run_nrs, nr_workers=None, 
+               threads_per_worker=None, fast=False):
+    """
+    Trains models of several runs concurrently in a pool of worker processes.
+
+    Ea worker loads TensorFlow once, pins its intra-op & inter-op thread 
+    counts (see `init_worker`) & then trains runs one after the other. Results 
+    of ea run are written by `main`, exactly as when runs are trained 
+    sequentially.
+
+    Processes are started w/ 'spawn', as forking a process in which 
+    TensorFlow has already started threads isn't safe.
+
+    Parameters:
+    - analysis_version (str): version number of the analysis
+    - run_nrs (iterable of int): run nrs to train
+    - nr_workers (int): nr of worker processes. Default: as many as fit on 
+    the node w/ `threads_per_worker` cores ea, but no more than nr of runs.
+    - threads_per_worker (int): nr of cores (intra-op threads) per worker. 
+    Default: cores split evenly among workers (at least 1).
+    - fast (bool): whether to train w/ XLA & mixed precision (see `main`), w/ 
+    oneDNN kernels enabled in workers (`TF_ENABLE_ONEDNN_OPTS=1`)
+
+    Returns:
+    - times (dict): execution time (s) of ea run, by run nr
+    """
+
+    run_nrs = list(run_nrs)
+    nr_cores = os.cpu_count() or 1
+
+    if nr_workers is None:
+        nr_workers = nr_cores // threads_per_worker if threads_per_worker else nr_cores
+    nr_workers = max(1, min(nr_workers, len(run_nrs)))
+    if threads_per_worker is None:
+        threads_per_worker = max(1, nr_cores // nr_workers)
+    # Split cores among workers- 1 worker per run, up to nr of cores.
+
+    environment = {'OMP_NUM_THREADS': str(threads_per_worker)}
+    if fast:
+        environment['TF_ENABLE_ONEDNN_OPTS'] = '1'
+    saved_environment = {name: os.environ.get(name) for name in environment}
+    os.environ.update(environment)
+    # Spawned workers inherit environment, so it's read before TensorFlow is 
+    # imported in them:
+    # - OpenMP (eg oneDNN built w/ OpenMP) uses worker's budget of threads
+    # - w/ fast path, TensorFlow uses oneDNN (CPU-optimised) kernels
+
+    times = {}
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=nr_workers, 
+                mp_context=multiprocessing.get_context('spawn'), 
+                initializer=init_worker, 
+                initargs=(threads_per_worker, 1)) as pool:
+        # 1 inter-op thread per worker- small CNN has little op-level parallelism, 
+        # concurrency comes from running several models.
+
+            futures = [pool.submit(run_worker, analysis_version, run_nr, fast) 
+                       for run_nr in run_nrs]
+            for future in concurrent.futures.as_completed(futures):
+                run_nr, run_time = future.result()
+                # Re-raises in parent any error raised while training a run.
+                times[run_nr] = run_time
+                print(f'Execution time for run {run_nr}: {run_time} s')
+    finally:
+        for name, value in saved_environment.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+    # Restore environment of this process.
+
+    return times
+
+
 if __name__ == '__main__':
 # Check if script is executed as standalone (main) program & call main fn if `True`.
     
@@ -486,19 +817,10 @@ if __name__ == '__main__':
     # Specify version nr of analysis & nr of runs.
     # Adjust as necessary.
     
-    for i in range(1, nr_runs + 1): # Iterate from 1 to `nr_runs` inclusive.
-
-        run_start_time = time.time()
-        # Capture current time at start of individual experimental run (job).
-
-        main(analysis_version, i)
-        # For ea run, call `main` fn, passing `analysis version` & current run 
-        # nr as args.
-
-        run_end_time = time.time() # end time for this run
-        print(f'Execution time for run {i}: {run_end_time - run_start_time} s')
-        # Calculate execution time for current run & output it to the console- 
-        # show how long ea run took.
+    train_runs(analysis_version, range(1, nr_runs + 1))
+    # Train models of runs 1 to `nr_runs` inclusive concurrently- 1 worker 
+    # process per run, w/ cores split evenly among workers (see `train_runs`).
+    # Execution time of ea run is output to the console as it finishes.
     
     end_time = time.time() # end time
     print(f'Total execution time: {end_time - start_time:.2f} s')
@@ -507,8 +829,7 @@ if __name__ == '__main__':
     # `:.2f`: a format specifier (syntax is specific to f-strings). Formats 
     # resulting floating-point nr to 2 decimal places for readability.
 
-# Code block executes script's main task in sequential manner for specified nr 
-# of runs.
+# Code block executes script's main task concurrently for specified nr of runs.
 # This is suitable for running on a local computer (as opposed to parallel 
 # execution of task on high-performance computing cluster).
 # Additionally, the dunder name main check enables us to execute script as 
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+"""
+Simulates, processes & trains a binary classifier on synthetic genetic data 
+'on the fly': the three stages run concurrently, connected by bounded queues.
+
+Instead of simulating all batches, then processing all batches, then training 
+(as 'Run_Simulations.py', 'Process_Synthetic_Data_Binary.py' & 'Train_Model.py' 
+do when run one after the other), ea batch is:
+- simulated (`run_simulations` w/ a single batch nr, in a producer thread)
+- processed as soon as its simulations land (`process_batch`, in a 2nd thread, 
+reading msms files serially)
+- trained on as soon as it is processed (`train_on_batch`, in main thread)
+while the next batches are being simulated & processed.
+Wall time per run drops from sum of the three stages to roughly slowest one.
+
+Bounded queues (1 batch by default) stop simulations from running far ahead 
+of training, so at most a few batches are held in memory at once.
+
+The last batch is held out for testing, as in 'Train_Model.py'.
+
+[
+The script is part of a bigger workflow. See 'Run_Simulations.py', 
+'Process_Synthetic_Data_Binary.py' & 'Train_Model.py' for an overview.
+]
+"""
+
+__author__ = 'cpenning@ic.ac.uk'
+__version__ = '0.0.1'
+
+#-----
+# Imports
+#-----
+# Standard-Library Imports
+import os
+# Module provides way to use functionality dependent on operating system. 
+# Incs fns to interact w file system in platform-independent way.
+
+import json # module for working w/ JSON data
+
+import queue
+# module provides thread-safe queues- used to pass batch nrs & processed 
+# batches between threads
+
+import threading # module to run fns concurrently in threads
+
+import time
+# module provides fns for working w/ times & dates
+
+# Local-Application Imports
+from ImaGene import *
+from Run_Simulations import run_simulations
+from Process_Synthetic_Data_Binary import process_batch
+from Train_Model import build_model, train_on_batch, evaluate_model, save_metrics_to_csv
+# W/ scripts in same directory as this script, import fns of ea stage.
+
+
+def simulate(param_file_path, path_sim, nr_batches, simulated):
+    """
+    Producer: simulates batches one at a time & puts ea batch nr in 
+    `simulated` queue once its simulations are saved.
+
+    A `None` is put at the end (or the exception, if simulations fail), so 
+    consumers know when to stop.
+    """
+    try:
+        for i in range(1, nr_batches + 1):
+            run_simulations(param_file_path, path_sim, batch=i)
+            # Run simulations of batch `i` only.
+            simulated.put(i)
+            # Blocks while queue is full, ie while processing is behind.
+        simulated.put(None)
+    except BaseException as error:
+        simulated.put(error)
+
+
+def process(path_sim, simulated, processed):
+    """
+    Consumer of simulated batches & producer of processed ones: processes ea 
+    simulated batch (saving it as store) & puts `(batch nr, ImaGene obj)` in 
+    `processed` queue.
+    """
+    try:
+        while True:
+            i = simulated.get()
+            if i is None or isinstance(i, BaseException):
+                processed.put(i)
+                break
+            processed.put((i, process_batch(path_sim, i, n_workers=1)))
+            # Read msms files of batch in this thread, 1 after another- a pool 
+            # of reader processes (ea re-importing TensorFlow) would compete w/ 
+            # training in main thread for cores & memory.
+    except BaseException as error:
+        processed.put(error)
+
+
+def train_on_the_fly(param_file_path, path_sim, path_results, nr_batches=10, 
+                     queue_size=1):
+    """
+    Runs simulations, processing & training of a run concurrently.
+
+    Parameters:
+    - param_file_path (str): path to file of simulation parameters
+    - path_sim (str): directory in which to save simulations & processed batches
+    - path_results (str): directory in which to save training & testing results
+    - nr_batches (int): nr of batches (last one is used for testing)
+    - queue_size (int): max nr of batches waiting between 2 stages
+
+    Returns:
+    - model: trained neural network model
+    - model_tracker: `ImaNet` object after training
+    """
+
+    simulated = queue.Queue(maxsize=queue_size)
+    processed = queue.Queue(maxsize=queue_size)
+    # Bounded queues between stages: simulations -> processing -> training.
+
+    threads = [threading.Thread(target=simulate, 
+                                args=(param_file_path, path_sim, nr_batches, simulated), 
+                                daemon=True), 
+               threading.Thread(target=process, 
+                                args=(path_sim, simulated, processed), 
+                                daemon=True)]
+    for thread in threads:
+        thread.start()
+    # Start producer threads. Simulations run as external processes (msms) & 
+    # processing mostly in NumPy, so both overlap w/ training in main thread.
+
+    model, model_tracker = None, None
+    while True:
+        item = processed.get()
+        # Wait for next processed batch.
+        if item is None:
+            break
+        if isinstance(item, BaseException):
+            raise item
+        # Re-raise errors of producer threads in main thread.
+
+        i, gene_sim = item
+        if i == nr_batches:
+            continue
+        # Last batch is only saved (for testing), not trained on.
+
+        print(f'Training on batch: {path_sim}/gene_sim_Batch{i}')
+        if model is None:
+            model, model_tracker = build_model(gene_sim, path_results)
+        # At 1st batch, build & compile model.
+
+        train_on_batch(gene_sim, model, model_tracker, seed=i)
+        # Train for 1 epoch on batch `i`.
+        del gene_sim, item
+
+    for thread in threads:
+        thread.join()
+
+    model_tracker.plot_train(os.path.join(path_results, 'training_plot.png'))
+    # Plot training & validation loss & accuracy over epochs.
+
+    return model, model_tracker
+
+
+def main(analysis_version, run_nr):
+    """
+    Orchestrates execution of the script's primary task.
+    
+    Parameters:
+    - analysis_version (str): version number of the analysis, used to construct 
+    dir paths
+    - run_nr (int): unique, sequential identifier for each experimental run (job).
+    """
+
+    config_file_path = os.path.join(analysis_version, 'Config_Files', 
+                                    f'config{run_nr}.json')
+    with open(config_file_path, 'r') as file:
+        config_data = json.load(file)
+    # Load config data of current run (see 'Run_Simulations.py').
+
+    param_file_path = os.path.join(analysis_version, config_data["param_file_path"])
+    path_sim = os.path.join('..', 'Data', analysis_version, 
+                            config_data["run_output_dir"])
+    path_results = os.path.join('..', 'Results', analysis_version, 
+                                config_data["run_output_dir"])
+    os.makedirs(path_sim, exist_ok=True)
+    os.makedirs(path_results, exist_ok=True)
+    # Construct paths to param file, simulations & results of current run, as 
+    # in other scripts of workflow.
+
+    model, model_tracker = train_on_the_fly(param_file_path, path_sim, path_results)
+    # Simulate, process & train concurrently.
+
+    test_loss, test_accuracy, model, model_tracker = evaluate_model(
+        os.path.join(path_sim, f'gene_sim_Batch{10}'), model, model_tracker, path_results)
+    # Evaluate trained model on unseen, test data- 10th/last batch.
+
+    save_metrics_to_csv(path_results, model_tracker.metrics)
+    model.save(os.path.join(path_results, 'model.binary.h5'))
+    model_tracker.save(os.path.join(path_results, 'model_tracker.binary'))
+    # Save test metrics, trained model & `ImaNet` obj, as in 'Train_Model.py'.
+
+
+if __name__ == '__main__':
+# Check if script is executed as standalone (main) program & call main fn if `True`.
+
+    start_time = time.time()
+
+    analysis_version = 'Version2'
+    nr_runs = 3
+    # Specify version nr of analysis & nr of runs.
+    # Adjust as necessary.
+
+    for i in range(1, nr_runs + 1): # Iterate from 1 to `nr_runs` inclusive.
+
+        run_start_time = time.time()
+
+        main(analysis_version, i)
+
+        run_end_time = time.time() # end time for this run
+        print(f'Execution time for run {i}: {run_end_time - run_start_time} s')
+
+    end_time = time.time() # end time
+    print(f'Total execution time: {end_time - start_time:.2f} s')